@@ -1,9 +1,206 @@
-import requests
-from flask import Flask, redirect, request
+import argparse
+import json
+import math
+import mimetypes
+import os
 import random
+import re
 import string
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, fields, replace
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+import requests
+from flask import Flask, Response, redirect, render_template, request, send_from_directory
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from constants import office_codes  # noqa: E402  real office names, so the bot can rank them
+
+
+@dataclass
+class Scenario:
+    offline: bool = False  # verify reCAPTCHA locally and serve everything the pages load from here
+    # step name (or '*' for every one) -> (fixed, a) | (uniform, low, high) | (lognormal, median, sigma), in seconds
+    latency: Dict[str, Tuple] = field(default_factory=dict)
+    error_503_rate: float = 0.0  # attempts answered with ERROR [503] at citar
+    no_cita_rate: float = 0.0  # attempts told there's no cita at acCitar
+    captcha_failure_rate: float = 0.0  # attempts failing reCAPTCHA at acVerificarCita
+    session_ttl_seconds: float = 0.0  # sessions older than this get the expired page, 0 for never
+    # outcomes of the first attempts, in order, before the rates apply: ok, 503, no_cita, captcha or expired
+    script: List[str] = field(default_factory=list)
+    # render acCitar and acOfertarCita from templates/ and give every page fresh hidden parameters
+    dynamic: bool = False
+    offices: int = 10  # offered at acCitar, the real ones first; 0 answers no cita
+    citas: int = 5  # offered at acOfertarCita; 0 answers no cita
+    cita_days: Tuple[int, int] = (1, 90)  # citas fall between these many days from today
+    check_params: bool = False  # expire sessions that don't post back the hidden parameters and choices they got
+    seed: Optional[int] = None
+
+
+scenarios = {
+    'default': Scenario(),
+    'offline': Scenario(offline=True, seed=1),
+    'realistic': Scenario(offline=True, latency={'*': ('lognormal', 0.25, 0.5)}, error_503_rate=0.05,
+                          no_cita_rate=0.8, captcha_failure_rate=0.1, seed=1),
+    'flaky': Scenario(offline=True, latency={'*': ('uniform', 0.05, 0.5)}, error_503_rate=0.3, seed=1),
+    'slow': Scenario(offline=True, latency={'*': ('lognormal', 1.0, 0.8), 'acOfertarCita': ('fixed', 3.0)}, seed=1),
+    'no_cita': Scenario(offline=True, no_cita_rate=1.0, seed=1),
+    'captcha': Scenario(offline=True, captcha_failure_rate=1.0, seed=1),
+    'expiring': Scenario(offline=True, session_ttl_seconds=2.0, latency={'*': ('fixed', 0.5)}, seed=1),
+    'scripted': Scenario(offline=True, script=['503', 'no_cita', 'captcha', 'expired', 'ok'], seed=1),
+    'dynamic': Scenario(offline=True, dynamic=True, check_params=True, seed=1),
+    'large': Scenario(offline=True, dynamic=True, offices=2000, citas=5000, cita_days=(1, 365), seed=1),
+}
+js_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'js')  # scripts saved from the site
+jquery_pattern = re.compile(r'jquery(?:-[\d.]+)?(?:\.min)?\.js')
+hidden_params_pattern = re.compile(r'<input type="hidden" name="([\da-f-]{36})" value(?:="([\da-f-]{36})")?/>'
+                                   r'<input type="hidden" name="([\da-f-]{36})" value(?:="([\da-f-]{36})")?/>')
+
+
+class Attempt:
+    __slots__ = ('started', 'outcome', 'params', 'offices', 'citas')
+
+    def __init__(self, outcome: str):
+        self.started = time.monotonic()
+        self.outcome = outcome
+        self.params: Dict[str, str] = {}  # the hidden parameters the last page asked to post back
+        self.offices: Set[str] = set()
+        self.citas = 0
+
 
 app = Flask(__name__)
+scenario = Scenario()
+rng = random.Random()
+lock = threading.Lock()
+attempts: Dict[str, Attempt] = {}  # session id -> attempt
+script: List[str] = []
+pages: Dict[str, str] = {}  # offline rewritten pages
+
+
+def load_scenario(name: str) -> Scenario:
+    # a scenario name, or the path to a JSON file with Scenario's fields
+    if name in scenarios:
+        return scenarios[name]
+    with open(name, 'r') as f:
+        data = json.loads(f.read())
+    names = {f.name for f in fields(Scenario)}
+    unknown = set(data) - names
+    if len(unknown) != 0:
+        raise ValueError(f'Unknown scenario fields: {", ".join(sorted(unknown))}')
+    return Scenario(**data)
+
+
+def use_scenario(s: Scenario):
+    global scenario
+    scenario = s
+    rng.seed(s.seed)
+    script[:] = s.script
+    attempts.clear()
+
+
+def sample_latency(spec: Tuple) -> float:
+    kind = spec[0]
+    if kind == 'fixed':
+        return spec[1]
+    if kind == 'uniform':
+        return rng.uniform(spec[1], spec[2])
+    if kind == 'lognormal':
+        return rng.lognormvariate(math.log(spec[1]), spec[2])
+    raise ValueError(f'Unknown latency distribution: {kind}')
+
+
+@app.before_request
+def inject_latency():
+    spec = scenario.latency.get(request.path.rsplit('/', 1)[-1], scenario.latency.get('*'))
+    if spec is not None:
+        with lock:
+            delay = sample_latency(spec)
+        time.sleep(delay)
+
+
+def offline_html(html: str) -> str:
+    # everything the page loads is served from here
+    return html.replace('https://www.google.com/recaptcha/api.js', '/recaptcha/api.js') \
+        .replace('https://sede.administracionespublicas.gob.es/', '/')
+
+
+def fresh_uuid() -> str:
+    with lock:
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def with_fresh_params(html: str) -> str:
+    # replaces every hidden parameter UUID, and remembers the first pair for check_params
+    m = hidden_params_pattern.search(html)
+    if m is None:
+        return html
+    uuids = {u: fresh_uuid() for u in m.groups() if u is not None}
+    for old, new in uuids.items():
+        html = html.replace(old, new)
+    attempt = current_attempt()
+    if attempt is not None:
+        attempt.params = {uuids[m.group(1)]: uuids.get(m.group(2), ''), uuids[m.group(3)]: uuids.get(m.group(4), '')}
+    return html
+
+
+def page(name: str, html: Optional[str] = None):
+    if html is None:
+        if not scenario.offline and not scenario.dynamic:
+            return app.send_static_file(name)
+        if name not in pages:
+            with open(os.path.join(app.static_folder, name), 'r', encoding='utf-8') as f:
+                pages[name] = f.read()
+        html = pages[name]
+    if scenario.offline:
+        html = offline_html(html)
+    if scenario.dynamic:
+        html = with_fresh_params(html)
+    return Response(html, mimetype='text/html')
+
+
+def current_attempt() -> Optional[Attempt]:
+    return attempts.get(request.cookies.get('JSESSIONID', ''))
+
+
+def expired() -> bool:
+    attempt = current_attempt()
+    if attempt is None:
+        return False
+    if attempt.outcome == 'expired':
+        return True
+    return scenario.session_ttl_seconds > 0 and time.monotonic() - attempt.started > scenario.session_ttl_seconds
+
+
+def posted_back() -> bool:
+    attempt = current_attempt()
+    if not scenario.check_params or attempt is None:
+        return True
+    return all(request.form.get(k) == v for k, v in attempt.params.items())
+
+
+def step_page(name: str, html: Optional[str] = None):
+    if expired() or not posted_back():
+        return page('session_expired.html')
+    return page(name, html)
+
+
+def generate_offices(n: int) -> List[Tuple[str, str]]:
+    names = sorted(office_codes.items(), key=lambda i: i[1])[:n]
+    offices = [(str(id), name) for name, id in names]
+    offices += [(str(1000 + i), f'OFICINA SIMULADA {i}, CALLE FALSA, {i}') for i in range(n - len(offices))]
+    return offices
+
+
+def generate_citas(n: int) -> List[Tuple[int, str, str]]:
+    first, last = scenario.cita_days
+    with lock:
+        slots = sorted((rng.randint(first, last), rng.randrange(8 * 12, 15 * 12)) for _ in range(n))
+    today = date.today()
+    return [(i + 1, (today + timedelta(days=d)).strftime('%d/%m/%Y'), f'{m // 12:02d}:{m % 12 * 5:02d}')
+            for i, (d, m) in enumerate(slots)]
 
 
 @app.route('/')
@@ -13,79 +210,143 @@ def index():
 
 @app.route('/pagina/index/directorio/icpplus')
 def portal():
-    return app.send_static_file('portal.html')
+    return page('portal.html')
 
 
 @app.route('/icpplus/', methods=['POST'])
 def icpplus():
-    return app.send_static_file('icpplus.html')
+    return page('icpplus.html')
 
 
 @app.route('/icpplustieb/citar')
 def citar():
-    return app.send_static_file('citar.html')
+    with lock:
+        if len(script) != 0:
+            outcome = script.pop(0)
+        elif rng.random() < scenario.error_503_rate:
+            outcome = '503'
+        elif rng.random() < scenario.no_cita_rate:
+            outcome = 'no_cita'
+        elif rng.random() < scenario.captcha_failure_rate:
+            outcome = 'captcha'
+        else:
+            outcome = 'ok'
+        if outcome == '503':
+            return page('error503.html'), 503
+        session_id = uuid.uuid4().hex.upper()
+        attempts[session_id] = Attempt(outcome)
+    resp = page('citar.html')
+    resp.set_cookie('JSESSIONID', session_id, path='/', httponly=True)
+    return resp
 
 
 @app.route('/icpplustieb/muestraMensajesTramite', methods=['POST'])
 def muestraMensajesTramite():
-    return app.send_static_file('muestraMensajesTramite.html')
+    return page('muestraMensajesTramite.html')
 
 
 @app.route('/icpplustieb/acInfo', methods=['POST'])
 @app.route('/icpplustieb/acInfo<jsessionid>', methods=['POST'])
 def acInfo(jsessionid=''):
-    return app.send_static_file('acInfo.html')
+    return step_page('acInfo.html')
 
 
 @app.route('/icpplustieb/acEntrada', methods=['POST'])
 def acEntrada():
-    return app.send_static_file('acEntrada.html')
+    return step_page('acEntrada.html')
 
 
 @app.route('/icpplustieb/acValidarEntrada', methods=['POST'])
 def acValidarEntrada():
-    return app.send_static_file('acValidarEntrada.html')
+    return step_page('acValidarEntrada.html')
 
 
 @app.route('/icpplustieb/acCitar', methods=['POST'])
 def acCitar():
-    return app.send_static_file('acCitar.html')
+    attempt = current_attempt()
+    if attempt is not None and attempt.outcome == 'no_cita':
+        return page('acCitar.no_cita.html')
+    if not scenario.dynamic:
+        return step_page('acCitar.html')
+    if scenario.offices == 0:
+        return page('acCitar.no_cita.html')
+    offices = generate_offices(scenario.offices)
+    if attempt is not None:
+        attempt.offices = {id for id, _ in offices}
+    return step_page('acCitar.html', render_template('acCitar.html', offices=offices))
 
 
 @app.route('/icpplustieb/acVerFormulario', methods=['GET', 'POST'])
 def acVerFormulario():
-    return app.send_static_file('acVerFormulario.html')
+    attempt = current_attempt()
+    if scenario.check_params and attempt is not None and request.form.get('idSede') not in attempt.offices:
+        return page('session_expired.html')
+    return step_page('acVerFormulario.html')
 
 
 @app.route('/icpplustieb/acOfertarCita', methods=['POST'])
 def acOfertarCita():
-    return app.send_static_file('acOfertarCita.html')
+    if not scenario.dynamic:
+        return step_page('acOfertarCita.html')
+    if scenario.citas == 0:
+        return page('acCitar.no_cita.html')
+    citas = generate_citas(scenario.citas)
+    attempt = current_attempt()
+    if attempt is not None:
+        attempt.citas = len(citas)
+    return step_page('acOfertarCita.html', render_template('acOfertarCita.html', citas=citas))
 
 
 @app.route('/icpplustieb/acVerificarCita', methods=['POST'])
 def acVerificarCita():
+    if expired() or not posted_back():
+        return page('session_expired.html')
+    attempt = current_attempt()
+    if scenario.check_params and attempt is not None and attempt.citas != 0 and \
+            request.form.get('rdbCita') not in map(str, range(1, attempt.citas + 1)):
+        return page('session_expired.html')
     action = request.form.get('action')
     recaptcha_response = request.form.get('g-recaptcha-response')
     if not is_human(recaptcha_response, action):
         print('reCAPTCHA triggered', flush=True)
-        return app.send_static_file('acVerificarCita.failed.html')
+        return page('acVerificarCita.failed.html')
     print('reCAPTCHA passed', flush=True)
     sms_verification_code = ''.join(random.choice(string.digits) for _ in range(5))
     print(sms_verification_code, flush=True)
-    return app.send_static_file('acVerificarCita.html')
+    return page('acVerificarCita.html')
 
 
 @app.route('/icpplustieb/acGrabarCita', methods=['POST'])
 def acGrabarCita():
-    return app.send_static_file('acGrabarCita.html')
+    return step_page('acGrabarCita.html')
+
+
+@app.route('/recaptcha/api.js')
+def recaptcha_stub():
+    return app.send_static_file('recaptcha_stub.js')
 
 
 @app.route('/<path:path>')
 def serve_static(path):
+    if scenario.offline and not os.path.exists(os.path.join(app.static_folder, path)):
+        # resources of the real site that were never saved, by file name if we have it, the site's own scripts
+        # from analysis/js, jQuery as the stub of what the pages call on it, or empty
+        name = os.path.basename(path).split(';', 1)[0]  # without the ;jsessionid some pages add
+        if os.path.exists(os.path.join(app.static_folder, name)):
+            return app.send_static_file(name)
+        if os.path.exists(os.path.join(js_path, name)):
+            return send_from_directory(js_path, name)
+        if jquery_pattern.fullmatch(name):
+            return app.send_static_file('jquery_stub.js')
+        return Response('', mimetype=mimetypes.guess_type(name)[0] or 'text/plain')
     return app.send_static_file(path)
 
 
 def is_human(recaptcha_response: str, action: str) -> bool:
+    if scenario.offline:
+        # tokens of the local stub pass unless the attempt is meant to fail
+        attempt = current_attempt()
+        return (recaptcha_response or '').startswith('offline-') and (attempt is None or attempt.outcome != 'captcha')
     recaptcha_secret_key = '6Lc3i_kcAAAAABx1xuczs-6kcEfLmhOtjwk7FRkf'
     payload = {'secret': recaptcha_secret_key, 'response': recaptcha_response, 'action': action}
     response = requests.post('https://www.google.com/recaptcha/api/siteverify', data=payload).json()
@@ -96,5 +357,24 @@ def is_human(recaptcha_response: str, action: str) -> bool:
     return response['success'] and response['score'] > 0.8
 
 
+# `flask --app analysis/simulator/main.py run` picks the scenario from the environment
+use_scenario(load_scenario(os.environ.get('SIMULATOR_SCENARIO', 'default')))
+
+
 if __name__ == '__main__':
-    app.run()
+    parser = argparse.ArgumentParser(description='Local simulator of the sede')
+    parser.add_argument('--scenario', default='default',
+                        help=f'one of {", ".join(scenarios)}, or a JSON file with the Scenario fields')
+    parser.add_argument('--offline', action='store_true', help='force offline mode on the scenario')
+    parser.add_argument('--seed', type=int, help='override the scenario seed')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    s = load_scenario(args.scenario)
+    if args.offline:
+        s = replace(s, offline=True)
+    if args.seed is not None:
+        s = replace(s, seed=args.seed)
+    use_scenario(s)
+    app.run(host=args.host, port=args.port, threaded=True)
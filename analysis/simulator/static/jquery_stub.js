@@ -0,0 +1,139 @@
+// offline stand-in for the site's jQuery, only what the saved pages and analysis/js call: selecting elements, reading
+// and setting values, attributes, classes and contents, showing and hiding them, binding events, focusing, submitting
+// forms and running code once the page is ready
+(function () {
+    function Selection(elements) {
+        this.elements = elements;
+        this.length = elements.length;
+    }
+
+    function jQuery(selector) {
+        if (typeof selector === 'function') {
+            return jQuery(document).ready(selector);
+        }
+        if (selector instanceof Selection) {
+            return selector;
+        }
+        if (typeof selector === 'string') {
+            return new Selection(Array.prototype.slice.call(document.querySelectorAll(selector)));
+        }
+        return new Selection(selector == null ? [] : [selector]);
+    }
+
+    function classNames(names) {
+        return names.split(/\s+/).filter(function (name) {
+            return name !== '';
+        });
+    }
+
+    jQuery.fn = Selection.prototype;
+    jQuery.fn.each = function (callback) {
+        this.elements.forEach(function (element, i) {
+            callback.call(element, i, element);
+        });
+        return this;
+    };
+    jQuery.fn.val = function (value) {
+        if (value === undefined) {
+            // undefined when nothing matches, e.g. no checked radio, which the pages compare with null
+            return this.length !== 0 ? this.elements[0].value : undefined;
+        }
+        return this.each(function () {
+            this.value = value;
+        });
+    };
+    jQuery.fn.attr = function (name, value) {
+        if (value === undefined) {
+            return this.length !== 0 ? this.elements[0].getAttribute(name) : undefined;
+        }
+        return this.each(function () {
+            this.setAttribute(name, value);
+        });
+    };
+    jQuery.fn.removeAttr = function (name) {
+        return this.each(function () {
+            this.removeAttribute(name);
+        });
+    };
+    jQuery.fn.addClass = function (names) {
+        return this.each(function () {
+            DOMTokenList.prototype.add.apply(this.classList, classNames(names));
+        });
+    };
+    jQuery.fn.removeClass = function (names) {
+        return this.each(function () {
+            DOMTokenList.prototype.remove.apply(this.classList, classNames(names));
+        });
+    };
+    jQuery.fn.html = function (html) {
+        if (html === undefined) {
+            return this.length !== 0 ? this.elements[0].innerHTML : undefined;
+        }
+        return this.each(function () {
+            this.innerHTML = html;
+        });
+    };
+    jQuery.fn.load = function (url) {
+        var selection = this;
+        fetch(url).then(function (response) {
+            return response.text();
+        }).then(function (html) {
+            selection.html(html);
+        });
+        return this;
+    };
+    jQuery.fn.show = function () {
+        return this.each(function () {
+            this.style.display = '';
+        });
+    };
+    jQuery.fn.hide = function () {
+        return this.each(function () {
+            this.style.display = 'none';
+        });
+    };
+    jQuery.fn.on = function (events, handler) {
+        return this.each(function () {
+            var element = this;
+            classNames(events).forEach(function (event) {
+                element.addEventListener(event, handler);
+            });
+        });
+    };
+    jQuery.fn.bind = jQuery.fn.on;
+    jQuery.fn.focus = function () {
+        if (this.length !== 0) {
+            this.elements[0].focus();
+        }
+        return this;
+    };
+    jQuery.fn.submit = function () {
+        return this.each(function () {
+            this.submit();
+        });
+    };
+    jQuery.fn.not = function (selector) {
+        return new Selection(this.elements.filter(function (element) {
+            return !element.matches(selector);
+        }));
+    };
+    jQuery.fn.ready = function (callback) {
+        function run() {
+            callback.call(document, jQuery);
+        }
+
+        if (document.readyState === 'loading') {
+            document.addEventListener('DOMContentLoaded', run);
+        } else {
+            setTimeout(run, 0);
+        }
+        return this;
+    };
+    // jquery-ui's datepicker, the pages only set it up
+    jQuery.fn.datepicker = function () {
+        return this;
+    };
+    jQuery.datepicker = {regional: {}, setDefaults: function () {}};
+
+    window.jQuery = window.$ = jQuery;
+})();
@@ -0,0 +1,29 @@
+// offline stand-in for https://www.google.com/recaptcha/api.js, its tokens are checked by the simulator itself
+(function () {
+    var token = 'offline-' + Math.random().toString(36).substring(2);
+
+    function fill() {
+        // as the page's own callback does, in case it fails
+        var response = document.getElementById('g-recaptcha-response');
+        if (response) response.value = token;
+        ['btnEnviar', 'btnSiguiente'].forEach(function (id) {
+            var button = document.getElementById(id);
+            if (button) button.removeAttribute('disabled');
+        });
+    }
+
+    window.grecaptcha = {
+        ready: function (callback) {
+            setTimeout(function () {
+                try {
+                    callback();
+                } finally {
+                    fill();
+                }
+            }, 0);
+        },
+        execute: function () {
+            return Promise.resolve(token);
+        }
+    };
+})();
@@ -0,0 +1,138 @@
+import asyncio
+import codecs
+from typing import Dict, Optional, Set
+from constants import *
+from http_engine import HttpEngine
+from page import Page, PageKind, PageScanner
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is optional, only the asyncio engine needs it
+    aiohttp = None
+
+
+class AsyncHttpEngine(HttpEngine):
+    # HttpEngine's lookup steps as coroutines, over one keep-alive connection pool kept for the whole run;
+    # every response is scanned while it streams in and reading stops as soon as the step has what it needs
+    session: Optional['aiohttp.ClientSession']
+    headers: Dict[str, str]
+    drains: Set[asyncio.Task]
+
+    def __init__(self, *args, chunk_size: int = 16384, **kwargs):
+        if aiohttp is None:
+            raise Exception('The asyncio HTTP engine needs aiohttp')
+        super().__init__(*args, **kwargs)
+        self.chunk_size = chunk_size
+        self.session = None
+        self.headers = {}
+        self.drains = set()
+
+    async def start(self):
+        # must run inside the event loop the steps run in
+        connector = aiohttp.TCPConnector(limit_per_host=4, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, headers=browser_headers,
+                                             cookie_jar=aiohttp.CookieJar(unsafe=True),  # the simulator is on an IP
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def close(self):
+        if len(self.drains) != 0:
+            await asyncio.gather(*self.drains, return_exceptions=True)
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method: str, url: str, expected: PageKind, **kwargs) -> Page:
+        scanner = PageScanner(expected)
+        try:
+            resp = await self.session.request(method, url, headers=self.headers, **kwargs)
+            decoder = codecs.getincrementaldecoder(resp.charset or 'utf-8')(errors='replace')
+            try:
+                async for chunk in resp.content.iter_chunked(self.chunk_size):
+                    if scanner.feed(decoder.decode(chunk)):
+                        break
+                else:
+                    scanner.feed(decoder.decode(b'', final=True))
+            except BaseException:
+                resp.close()
+                raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise FailedAttempt(f'{url.rsplit("/", 1)[-1]} request failed: {e!r}')
+
+        page = scanner.page()
+        if self.capture is not None:
+            self.capture(url.rsplit('/', 1)[-1].split('?')[0], page.html)  # only what was read of it
+        if resp.content.at_eof():
+            resp.release()
+        elif page.kind in (PageKind.ERROR_503, PageKind.NO_CITA):
+            resp.close()  # the attempt ends here, drop the connection instead of reading the rest
+        else:
+            # read the rest in the background, so the connection goes back to the pool
+            task = asyncio.ensure_future(self.drain(resp))
+            self.drains.add(task)
+            task.add_done_callback(self.drains.discard)
+        self.last_url = url
+        self.last_page = page
+        return page
+
+    @staticmethod
+    async def drain(resp: 'aiohttp.ClientResponse'):
+        try:
+            await resp.content.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            resp.close()
+        else:
+            resp.release()
+
+    async def post(self, step: str, expected: PageKind = PageKind.OTHER, **kwargs) -> Page:
+        url = f'{self.base_url}/icpplustieb/{step}'
+        page = await self.request('POST', url, expected, **kwargs)
+        self.headers['Referer'] = url
+        return page
+
+    async def citar(self):
+        if self.session is None:
+            await self.start()
+        self.session.cookie_jar.clear()  # a new server session on every attempt, the connections are kept
+        self.headers = {}
+        url = f'{self.base_url}/icpplustieb/citar?p=8&locale=es'
+        page = await self.request('GET', url, PageKind.OTHER)
+        if page.kind == PageKind.ERROR_503:
+            raise ServerError('Server 503 error')
+        self.update_session_params(page.html)
+        self.headers = {'Referer': url, 'Origin': self.base_url, 'Cache-Control': 'max-age=0'}
+
+    async def acInfo(self):
+        page = await self.post('acInfo', data=self.session_params | self.info_fields())
+        self.update_session_params(page.html)
+
+    async def acEntrada(self):
+        page = await self.post('acEntrada', data=self.session_params)
+        self.update_session_params(page.html)
+
+    async def acValidarEntrada(self):
+        # multipart/form-data, like the browser sends it
+        form = aiohttp.FormData(self.session_params | self.validar_entrada_fields(), default_to_multipart=True)
+        page = await self.post('acValidarEntrada', data=form)
+        self.update_session_params(page.html)
+
+    async def acCitar(self):
+        expected = PageKind.OFFICES if self.tramite_code == 4010 else PageKind.OTHER  # toma de huellas
+        page = await self.post('acCitar', expected, data=self.session_params)
+        self.office_id = self.choose_office_id(page)  # '' for recogida de tarjeta, there is no office to choose
+        self.update_session_params(page.html)
+
+    async def acVerFormulario(self):
+        if self.office_id == '':
+            return
+        page = await self.post('acVerFormulario', data=self.session_params | {'idSede': self.office_id})
+        self.update_session_params(page.html)
+
+    async def acOfertarCita(self):
+        # read whole, the offered page is handed over to the browser
+        page = await self.post('acOfertarCita', PageKind.CITAS, data=self.session_params | self.contact_fields())
+        self.cita_id = self.choose_cita_id(page)
+        self.update_session_params(page.html)
+
+    def cookies(self) -> list:
+        return [{'name': c.key, 'value': c.value, 'url': self.base_url, 'path': c['path'] or '/',
+                 'secure': bool(c['secure']), 'httpOnly': bool(c['httponly'])} for c in self.session.cookie_jar]
@@ -0,0 +1,298 @@
+import argparse
+import atexit
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from statistics import mean, median
+from time import perf_counter, process_time, sleep
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.error import URLError
+from urllib.request import urlopen
+from config import App, Info
+from constants import FailedAttempt
+from page import PageKind
+
+try:
+    import psutil
+except ImportError:  # psutil is optional, without it the browser's CPU and memory aren't measured
+    psutil = None
+
+simulator_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analysis', 'simulator', 'main.py')
+
+
+def start_simulator(port: int, scenario: str = 'offline') -> subprocess.Popen:
+    proc = subprocess.Popen([sys.executable, simulator_path, '--port', str(port), '--scenario', scenario],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urlopen(f'http://127.0.0.1:{port}/pagina/index/directorio/icpplus', timeout=1).read()
+            return proc
+        except (URLError, ConnectionError):
+            if proc.poll() is not None:
+                raise Exception('Simulator exited on startup')
+            sleep(0.1)
+    proc.terminate()
+    raise Exception('Simulator did not start')
+
+
+class BrowserTree:
+    # CPU time and RSS of the chromedriver process and everything it spawned
+    def __init__(self, pid: Optional[int], network=None, metrics=None):
+        self.proc = psutil.Process(pid) if psutil is not None and pid is not None else None
+        self.peak_rss = 0
+        self.network = network  # main.AutoCita's NetworkMonitor, if it counts bytes
+        self.metrics = metrics  # main.AutoCita's Metrics, for the timings recorded inside steps
+        self.network_bytes: List[int] = []
+        self.network_requests: List[int] = []
+
+    def collect_network(self):
+        if self.network is not None:
+            transferred, requests, _ = self.network.collect()
+            self.network_bytes.append(transferred)
+            self.network_requests.append(requests)
+
+    def processes(self) -> list:
+        if self.proc is None:
+            return []
+        try:
+            return [self.proc] + self.proc.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def cpu_seconds(self) -> float:
+        total = 0.0
+        for p in self.processes():
+            try:
+                t = p.cpu_times()
+                total += t.user + t.system
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def sample_rss(self):
+        rss = 0
+        for p in self.processes():
+            try:
+                rss += p.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.peak_rss = max(self.peak_rss, rss)
+
+
+def new_attempt(c):
+    # every run is an attempt of its own, not a retry at the next office of the last one
+    c.start_attempt()
+    c.office_ranker.reset()
+
+
+def verification_page(c):
+    # as far as http_flow goes: AutoCita.acVerificarCita would go on to ask for the SMS code on stdin
+    if c.read_page(PageKind.CAPTCHA_FAILED, PageKind.SMS_VERIFICATION, PageKind.OTHER).kind == PageKind.CAPTCHA_FAILED:
+        raise FailedAttempt('Failed to pass reCAPTCHA')
+
+
+def selenium_flow(base_url: str, app: App, info: Info) -> Tuple[List[Tuple[str, Callable]], BrowserTree, Callable]:
+    from main import AutoCita  # selenium is only needed for this flow
+
+    c = AutoCita(app, info)
+    c.base_url = base_url
+    # same steps, in the same order, as AutoCita.work(), up to the SMS verification that needs a human
+    steps = [(name, lambda step=getattr(c, name): c.run_step(step))
+             for name in ('citar', 'acInfo', 'acEntrada', 'acValidarEntrada', 'acCitar', 'acVerFormulario',
+                          'acOfertarCita')] + [('acVerificarCita', lambda: verification_page(c))]
+    return steps, BrowserTree(c.browser.service.process.pid, c.network if c.count_network else None, c.metrics), \
+        lambda: new_attempt(c)
+
+
+def hybrid_flow(base_url: str, app: App, info: Info) -> Tuple[List[Tuple[str, Callable]], BrowserTree, Callable]:
+    from main import AutoCita
+
+    app.transport = 'hybrid'
+    app.hybrid_lazy_browser = False  # Chrome's startup is not part of an attempt
+    c = AutoCita(app, info)
+    c.base_url = base_url
+    c.http.base_url = base_url
+    atexit.register(c.close)
+    # same steps as AutoCita.work() with the hybrid transport, up to the SMS verification
+    steps = [(step.__name__, lambda step=step: c.run_step(step))
+             for step in c.http.lookup_steps + (c.hand_over,)] + [('acVerificarCita', lambda: verification_page(c))]
+    return steps, BrowserTree(c.browser.service.process.pid, c.network if c.count_network else None, c.metrics), \
+        lambda: new_attempt(c)
+
+
+def lookup_flow(base_url: str, app: App, info: Info) -> Tuple[List[Tuple[str, Callable]], BrowserTree, Callable]:
+    from main import AutoCita
+
+    app.transport = 'hybrid'
+    app.hybrid_lazy_browser = True  # never started, only the HTTP lookup steps run
+    c = AutoCita(app, info)
+    c.base_url = base_url
+    c.http.base_url = base_url
+    atexit.register(c.close)
+    return [(step.__name__, lambda step=step: c.run_step(step)) for step in c.http.lookup_steps], BrowserTree(None), \
+        lambda: new_attempt(c)
+
+
+def http_flow(base_url: str, app: App, info: Info) -> Tuple[List[Tuple[str, Callable]], BrowserTree, Callable]:
+    from distance_providers import make_distance_providers
+    from old import AutoCita
+
+    distance_provider, _ = make_distance_providers(app.distance_provider, app.google_maps_api_key,
+                                                   info.travel_mode, info.address_coordinates)
+    c = AutoCita(info, distance_provider, app.debug)
+    c.base_url = base_url
+    state = {}
+
+    def acCitar():
+        state['office_id'] = c.acCitar()
+
+    def acOfertarCita():
+        state['cita_id'] = c.acOfertarCita()
+
+    # same steps as old.AutoCita.work(), up to the SMS verification that needs a human
+    steps = [('init_session', c.init_session), ('citar', c.citar), ('acInfo', c.acInfo), ('acEntrada', c.acEntrada),
+             ('acValidarEntrada', c.acValidarEntrada), ('acCitar', acCitar),
+             ('acVerFormulario', lambda: c.acVerFormulario(state['office_id'])), ('acOfertarCita', acOfertarCita),
+             ('acVerificarCita', lambda: c.acVerificarCita(state['cita_id']))]
+
+    def start_run():
+        state.clear()
+        c.tried_offices.clear()
+
+    return steps, BrowserTree(None), start_run
+
+
+flows = {'selenium': selenium_flow, 'hybrid': hybrid_flow, 'lookup': lookup_flow, 'http': http_flow}
+
+
+def summarize(samples: List[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'mean_ms': round(mean(samples) * 1000, 3),
+        'median_ms': round(median(samples) * 1000, 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+        'min_ms': round(samples[0] * 1000, 3),
+        'max_ms': round(samples[-1] * 1000, 3),
+    }
+
+
+def run(flow: str, base_url: str, runs: int, app: App, info: Info) -> dict:
+    steps, browser, start_run = flows[flow](base_url, app, info)
+    step_times: Dict[str, List[float]] = {name: [] for name, _ in steps}
+    totals = []
+    outcomes = {}
+    cpu_start, browser_cpu_start = process_time(), browser.cpu_seconds()
+    for _ in range(runs):
+        start_run()
+        outcome = 'completed'
+        run_start = perf_counter()
+        for name, step in steps:
+            start = perf_counter()
+            try:
+                step()
+            except Exception as e:
+                outcome = f'{name}: {type(e).__name__}'
+                break
+            finally:
+                step_times[name].append(perf_counter() - start)
+                browser.sample_rss()
+        totals.append(perf_counter() - run_start)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        browser.collect_network()
+
+    return {
+        'flow': flow,
+        'runs': runs,
+        'base_url': base_url,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'steps': {name: summarize(times) for name, times in step_times.items() if len(times) != 0},
+        'total': summarize(totals),
+        'outcomes': outcomes,
+        'cpu_seconds': {'python': round(process_time() - cpu_start, 3),
+                        'browser': round(browser.cpu_seconds() - browser_cpu_start, 3)},
+        'peak_rss_kb': {'python': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                        'browser': browser.peak_rss // 1024},
+        'inner_steps': {name: {'count': h.count, 'mean_ms': round(h.sum / h.count * 1000, 3)}
+                        for name, h in (browser.metrics.steps.items() if browser.metrics is not None else [])
+                        if name not in step_times and h.count != 0},
+        'network_per_run': {'bytes': round(mean(browser.network_bytes)) if browser.network_bytes else None,
+                            'requests': round(mean(browser.network_requests)) if browser.network_requests else None},
+    }
+
+
+def compare(baseline: dict, result: dict):
+    print(f'{"step":<20}{"baseline ms":>14}{"current ms":>14}{"change":>10}')
+    for name, stats in list(result['steps'].items()) + [('total', result['total'])]:
+        before = baseline['total'] if name == 'total' else baseline['steps'].get(name)
+        if before is None:
+            print(f'{name:<20}{"-":>14}{stats["median_ms"]:>14.1f}{"":>10}')
+            continue
+        change = (stats['median_ms'] - before['median_ms']) / before['median_ms'] * 100 if before['median_ms'] else 0
+        print(f'{name:<20}{before["median_ms"]:>14.1f}{stats["median_ms"]:>14.1f}{change:>+9.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the booking flows against the local simulator')
+    parser.add_argument('--flow', choices=list(flows), default='http')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--port', type=int, default=5000, help='port to start the simulator on')
+    parser.add_argument('--base-url', help='use an already running simulator instead of starting one')
+    parser.add_argument('--scenario', default='offline',
+                        help='simulator scenario, see analysis/simulator/main.py; offline needs no network')
+    parser.add_argument('--wait', choices=['observer', 'poll'], default='observer',
+                        help='element waits of the selenium flow, compare both with --output/--compare')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='poll interval of the selenium flow waits')
+    parser.add_argument('--session-reset', choices=['cdp', 'reload'], default='cdp',
+                        help='how the selenium flow resets the session, timed as the session_reset step')
+    parser.add_argument('--http-engine', choices=['requests', 'asyncio'], default='requests',
+                        help='HTTP engine of the hybrid and lookup flows')
+    parser.add_argument('--block-requests', action='store_true', help='block images, fonts and trackers')
+    parser.add_argument('--corpus', help='record the page sources into this corpus, see corpus.py')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    # rank offices offline, and keep the distance cache and the simulator's offices out of the way
+    temp_path = tempfile.mkdtemp()
+    app = App(debug=False, sleep_minutes=0, distance_provider='haversine',
+              wait_with_observer=args.wait == 'observer', wait_poll_interval=args.poll_interval,
+              block_requests=args.block_requests, session_reset=args.session_reset, http_engine=args.http_engine,
+              distance_cache_path=os.path.join(temp_path, 'office_distances.db'), history_path='',
+              office_catalog_path=os.path.join(temp_path, 'offices.db'),
+              corpus_path=args.corpus or '')
+    info = Info(max_cita_date='31/12/2099')  # don't stop at the simulator's fixed cita date
+
+    simulator = None
+    base_url = args.base_url
+    if base_url is None:
+        simulator = start_simulator(args.port, args.scenario)
+        base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        result = run(args.flow, base_url, args.runs, app, info)
+    finally:
+        if simulator is not None:
+            simulator.terminate()
+            simulator.wait()
+    result['settings'] = {'scenario': args.scenario if args.base_url is None else None, 'wait': args.wait,
+                          'poll_interval': args.poll_interval, 'block_requests': args.block_requests,
+                          'session_reset': args.session_reset, 'http_engine': args.http_engine}
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(result, indent=2))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(json.loads(f.read()), result)
+
+
+if __name__ == '__main__':
+    main()
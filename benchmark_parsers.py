@@ -0,0 +1,249 @@
+import argparse
+import glob
+import math
+import os
+from datetime import datetime
+from timeit import Timer
+from typing import Callable, Dict, List, Tuple
+from constants import nie_pattern, uuid_pattern, uuid_attr_pattern, html_attr_pattern, \
+    offices_pattern, cita_pattern, cita_code_pattern
+from page import Page, PageKind, PageScanner, parse_page, find_markers, extract_hidden_params
+from cita_selector import CitaSelector
+
+static_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analysis', 'simulator', 'static')
+uuid_a = '0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0'
+uuid_b = '1a2b3c4d-5e6f-7a8b-9c0d-1e2f3a4b5c6d'
+hidden_params_html = f'<form><input type="hidden" name="{uuid_a}" value="{uuid_b}"/>' \
+                     f'<input type="hidden" name="{uuid_b}" value="{uuid_a}"/></form>'
+# a scaling exponent above this, between the smallest and the largest synthetic page, is reported as superlinear
+superlinear_exponent = 1.3
+
+
+def ns_per_call(fn: Callable, arg, budget: float = 0.02) -> float:
+    # best of 3 runs of about budget seconds each, there are hundreds of measurements
+    timer = Timer(lambda: fn(arg))
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= budget:
+            break
+        number = max(number * 2, int(number * budget / max(elapsed, 1e-9)))
+    return min([elapsed] + timer.repeat(repeat=2, number=number)) / number * 1e9
+
+
+def simulator_pages() -> Dict[str, str]:
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(static_path, '*.html'))):
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+
+# synthetic pages, n is roughly the number of tags (options, citas) in them
+def office_option(i: int) -> str:
+    return f'<option value="{100 + i}" >CNP OFICINA {i}, CALLE FALSA, {i}</option>'
+
+
+def offices_page(n: int) -> str:
+    # the site's layout, one option per line
+    return '<select id="idSede" name="idSede">\n' + '\n'.join(office_option(i) for i in range(n)) + \
+        '\n</select>' + hidden_params_html
+
+
+def minified_offices_page(n: int) -> str:
+    # the same options on one line
+    return '<select id="idSede" name="idSede">' + ''.join(office_option(i) for i in range(n)) + '</select>' + \
+        hidden_params_html
+
+
+def cita(i: int) -> str:
+    # a cita block as the site lays it out
+    return (f'<input type="radio" id="cita{i}" name="rdbCita" value="{i}"/><label for="cita{i}"><strong>'
+            f'<span>CITA</span> {i}\n    </strong> <br /> <span>Día</span>: <span>{1 + i % 28:02d}/01/2030</span> '
+            f'<br /> <span>Hora</span>: <span>{8 + i % 7:02d}:{i % 60:02d}</span> <br />\n</label>\n')
+
+
+def citas_page(n: int) -> str:
+    return ''.join(cita(i) for i in range(1, n + 1)) + hidden_params_html
+
+
+def filler_page(n: int) -> str:
+    # a long page of ordinary inputs, the hidden parameters at the very end
+    return '<input type="text" name="field" value="x"/>\n' * n + hidden_params_html
+
+
+# adversarial pages, almost what a pattern looks for and as expensive as possible to reject
+def near_miss_page(n: int) -> str:
+    # hidden inputs that almost look like the parameters: one lone UUID input, truncated UUIDs, a missing value quote
+    return (f'><input type="hidden" name="{uuid_a}" value="{uuid_b}"/><br/>'
+            f'><input type="hidden" name="{uuid_a[:-1]}" value="{uuid_b}"/>'
+            f'<input type="hidden" name="{uuid_a}" value="{uuid_b[:-3]}/>\n') * n + hidden_params_html
+
+
+def unclosed_tag_page(n: int) -> str:
+    # an input tag that never closes, followed by a lot of text
+    return '<input type="hidden" name="' + 'a' * 10 * n + hidden_params_html
+
+
+def unclosed_options_page(n: int) -> str:
+    # options on one line, none of them closed
+    return '<select id="idSede" name="idSede">' + f'<option value="1" >CNP OFICINA, CALLE FALSA' * n + '</select>'
+
+
+def cita_near_miss_page(n: int) -> str:
+    # cita headers whose date never comes
+    return '<span>CITA</span> 1 <br /> <span>Día</span>: <span>1/1/2030</span>\n' * n
+
+
+synthetic_pages: Dict[str, Callable[[int], str]] = {
+    'offices': offices_page,
+    'minified_offices': minified_offices_page,
+    'citas': citas_page,
+    'filler': filler_page,
+    'near_miss': near_miss_page,
+    'unclosed_tag': unclosed_tag_page,
+    'unclosed_options': unclosed_options_page,
+    'cita_near_miss': cita_near_miss_page,
+}
+# what the parsers must find on the synthetic pages of size n
+expected_offices = {'offices': lambda n: n, 'minified_offices': lambda n: n}
+expected_citas = {'citas': lambda n: n}
+
+
+def markers(html: str) -> dict:
+    positions = {}
+    find_markers(html, positions)
+    return positions
+
+
+def stream(html: str):
+    # in the chunks the asyncio engine reads, to the end
+    scanner = PageScanner(PageKind.CITAS)
+    for i in range(0, len(html), 16384):
+        scanner.feed(html[i:i + 16384])
+    return scanner.page().citas
+
+
+def strptime_cita(citas: list):
+    # what AutoCita.choose_cita_id used to do, with a max date no cita is before, so every date is parsed
+    for cita in citas:
+        if datetime.strptime(cita.date, '%d/%m/%Y') > datetime.min:
+            continue
+        return cita.id
+    return ''
+
+
+# every constraint, so every check runs
+selector = CitaSelector('01/01/2000', '31/12/2099', ['08:00-10:30', '12:00-14:00'], [5, 6], 'closest', '09:15')
+
+
+def select_cita(citas: list):
+    # the selector's caches warmed up by the earlier calls, as during a run
+    return selector.best(citas)
+
+
+def select_cita_cold(citas: list):
+    return CitaSelector('01/01/2000', '31/12/2099', ['08:00-10:30', '12:00-14:00'], [5, 6], 'closest',
+                        '09:15').best(citas)
+
+
+def parsed_citas(html: str) -> list:
+    return parse_page(html).citas
+
+
+def identity(html: str) -> str:
+    return html
+
+
+def count(result) -> int:
+    if isinstance(result, Page):
+        return len(result.offices) + len(result.citas)
+    if isinstance(result, (list, dict)):
+        return len(result)
+    return int(result is not None and result != '')
+
+
+# name -> (prepare, fn); prepare runs untimed and turns a page into fn's argument, fn's result counts the matches
+targets: Dict[str, Tuple[Callable, Callable]] = {
+    'page_markers': (identity, markers),
+    'offices_pattern': (identity, offices_pattern.findall),
+    'cita_pattern': (identity, cita_pattern.findall),
+    'cita_code_pattern': (identity, cita_code_pattern.findall),
+    'uuid_pattern': (identity, uuid_pattern.findall),
+    'uuid_attr_pattern': (identity, uuid_attr_pattern.findall),
+    'html_attr_pattern': (identity, html_attr_pattern.findall),
+    'nie_pattern': (identity, nie_pattern.match),
+    'parse_page': (identity, parse_page),
+    'PageScanner': (identity, stream),
+    'extract_hidden_params': (identity, extract_hidden_params),
+    'strptime_cita': (parsed_citas, strptime_cita),
+    'CitaSelector': (parsed_citas, select_cita),  # AutoCita.choose_cita_id
+    'CitaSelector_cold': (parsed_citas, select_cita_cold),
+}
+
+
+def measure(target: str, html: str) -> Tuple[float, int]:
+    # (ns per call, matches)
+    prepare, fn = targets[target]
+    arg = prepare(html)
+    return ns_per_call(fn, arg), count(fn(arg))
+
+
+def scaling(target: str, make_page: Callable[[int], str], sizes: List[int]) -> Tuple[List[float], float]:
+    times = [measure(target, make_page(n))[0] for n in sizes]
+    exponent = math.log(times[-1] / times[0]) / math.log(sizes[-1] / sizes[0])
+    return times, exponent
+
+
+def check(page_name: str, n: int) -> List[str]:
+    # what parse_page gets wrong about a synthetic page
+    html = synthetic_pages[page_name](n)
+    page = parse_page(html)
+    wrong = []
+    if page_name in expected_offices and len(page.offices) != expected_offices[page_name](n):
+        wrong.append(f'{len(page.offices)} offices on {page_name}({n})')
+    if page_name in expected_offices and any('<' in o.name for o in page.offices):
+        wrong.append(f'office names run into the next option on {page_name}({n})')
+    if page_name in expected_citas and len(page.citas) != expected_citas[page_name](n):
+        wrong.append(f'{len(page.citas)} citas on {page_name}({n})')
+    return wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark the page parsers')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='synthetic page sizes, in repeated tags')
+    parser.add_argument('--target', nargs='+', choices=list(targets), default=list(targets))
+    parser.add_argument('--page', nargs='+', choices=list(synthetic_pages), default=list(synthetic_pages),
+                        help='synthetic pages')
+    parser.add_argument('--skip-static', action='store_true', help='skip the simulator pages')
+    args = parser.parse_args()
+
+    if not args.skip_static:
+        print(f'{"page":<32}{"target":<24}{"us/call":>10}{"matches":>10}{"ns/match":>12}')
+        for page_name, html in simulator_pages().items():
+            for target in args.target:
+                ns, matches = measure(target, html)
+                print(f'{page_name:<32}{target:<24}{ns / 1000:>10.1f}{matches:>10}{ns / max(1, matches):>12.0f}')
+        print()
+
+    print(f'{"synthetic page":<20}{"target":<24}' + ''.join(f'{n:>12}' for n in args.sizes) + f'{"exponent":>10}')
+    flagged = []
+    wrong = []
+    for page_name in args.page:
+        make_page = synthetic_pages[page_name]
+        for target in args.target:
+            times, exponent = scaling(target, make_page, args.sizes)
+            print(f'{page_name:<20}{target:<24}' + ''.join(f'{t / 1000:>9.1f} us' for t in times) +
+                  f'{exponent:>10.2f}')
+            if exponent > superlinear_exponent:
+                flagged.append(f'{target} on {page_name}')
+        wrong += check(page_name, args.sizes[-1])
+    for name in flagged:
+        print(f'[WARNING] Superlinear: {name}')
+    for w in wrong:
+        print(f'[WARNING] Wrong result: {w}')
+
+
+if __name__ == '__main__':
+    main()
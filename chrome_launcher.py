@@ -0,0 +1,114 @@
+import argparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import urllib.request
+from time import perf_counter, sleep
+from typing import List, Optional
+from constants import browser_headers
+from config import App
+
+chrome_binaries = ['google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser', 'chrome',
+                   '/Applications/Google Chrome.app/Contents/MacOS/Google Chrome',
+                   r'C:\Program Files\Google\Chrome\Application\chrome.exe']
+
+
+def chrome_arguments(chrome_profile_path: str, headless: bool, hybrid: bool) -> List[str]:
+    # the command line flags of the bot's Chrome, whether ChromeDriver or the launcher starts it
+    arguments = [
+        '--disable-extensions',
+        '--disable-plugins-discovery',
+        '--disable-notifications',
+        '--disable-translate',
+        '--disable-sync',
+        '--disable-infobars',
+        '--disable-gpu',
+        '--lang=en',
+        # '--no-sandbox',
+        '--window-size=1280,800',
+        '--no-first-run',
+        '--no-service-autorun',
+        '--password-store=basic',
+        '--disable-blink-features=AutomationControlled',
+        f'--user-data-dir={chrome_profile_path}',
+    ]
+    if headless:
+        arguments.append('--headless')
+    if hybrid:
+        # the browser takes over the HTTP engine's session, it must look like the same client
+        arguments.append(f"--user-agent={browser_headers['User-Agent']}")
+    return arguments
+
+
+def find_chrome() -> Optional[str]:
+    for binary in chrome_binaries:
+        path = shutil.which(binary) or (binary if os.path.isfile(binary) else None)
+        if path is not None:
+            return path
+    return None
+
+
+def is_up(address: str, timeout: float = 1) -> bool:
+    # whether a browser answers on its remote debugging address
+    try:
+        with urllib.request.urlopen(f'http://{address}/json/version', timeout=timeout) as resp:
+            return resp.status == 200
+    except OSError:
+        return False
+
+
+def launch(chrome: str, address: str, arguments: List[str], timeout: float = 30) -> subprocess.Popen:
+    port = address.rsplit(':', 1)[1]
+    # Chrome only listens on localhost
+    process = subprocess.Popen([chrome, f'--remote-debugging-port={port}', '--accept-lang=en_US,es_ES,ca'] +
+                               arguments + ['about:blank'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = perf_counter() + timeout
+    while not is_up(address):
+        if process.poll() is not None:
+            raise Exception(f'Chrome exited with code {process.returncode}')
+        if perf_counter() > deadline:
+            process.kill()
+            raise Exception(f'Chrome didn\'t open {address} in {timeout:.0f} seconds')
+        sleep(0.1)
+    return process
+
+
+def main():
+    app = App()
+    parser = argparse.ArgumentParser(description='Keep a Chrome up for AutoCita to attach to, '
+                                                 'set App.chrome_debugger_address to the same address')
+    parser.add_argument('--address', default=app.chrome_debugger_address or '127.0.0.1:9222')
+    parser.add_argument('--chrome', default=find_chrome(), help='Chrome binary')
+    parser.add_argument('--headed', action='store_true', help='show the browser, as with App.debug')
+    parser.add_argument('--check-interval', type=float, default=5, help='seconds between checks it\'s still up')
+    args = parser.parse_args()
+    if args.chrome is None:
+        parser.error('Chrome not found, pass --chrome')
+
+    # stopped as a service, Chrome goes down with it as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    arguments = chrome_arguments(app.chrome_profile_path, not (args.headed or app.debug), app.transport == 'hybrid')
+    process = None
+    try:
+        while True:
+            if not is_up(args.address):
+                if process is not None:
+                    print(f'[WARNING] Chrome on {args.address} went away, restarting it')
+                    process.kill()
+                    process.wait()
+                start = perf_counter()
+                process = launch(args.chrome, args.address, arguments)
+                print(f'[INFO] Chrome listening on {args.address}, started in {perf_counter() - start:.2f} s')
+            sleep(args.check_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+from page import Cita
+
+ranks = ('earliest', 'latest', 'closest')
+
+
+def parse_date(s: str) -> int:
+    # dd/mm/yyyy -> yyyymmdd, raises ValueError when it isn't a valid date
+    s = s.strip()
+    if len(s) != 10 or s[2] != '/' or s[5] != '/':
+        raise ValueError(s)
+    day, month, year = int(s[:2]), int(s[3:5]), int(s[6:])
+    date(year, month, day)
+    return year * 10000 + month * 100 + day
+
+
+def parse_time(s: str) -> int:
+    # HH:MM -> minute of the day, raises ValueError when it isn't a valid time
+    s = s.strip()
+    if len(s) != 5 or s[2] != ':':
+        raise ValueError(s)
+    hour, minute = int(s[:2]), int(s[3:])
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(s)
+    return hour * 60 + minute
+
+
+class CitaSelector:
+    # picks the cita to book in one pass over the offered ones: dates and times are turned into integer keys
+    # once per distinct string, offered pages repeat the same few dates and times, and every cita outside
+    # the constraints is dropped by a dictionary lookup
+    dates: Dict[str, Optional[int]]  # dd/mm/yyyy -> yyyymmdd * 10000, None when excluded
+    times: Dict[str, Optional[Tuple[int, int]]]  # HH:MM -> (minute of the day, its cost), None when excluded
+
+    def __init__(self, min_date: str = '', max_date: str = '', time_windows: Iterable[str] = (),
+                 excluded_weekdays: Iterable[int] = (), rank: str = 'earliest', preferred_time: str = ''):
+        try:
+            self.min_date = parse_date(min_date) if min_date.strip() else 0
+        except ValueError:
+            raise ValueError('Min cita date format error')
+        try:
+            self.max_date = parse_date(max_date) if max_date.strip() else 99999999
+        except ValueError:
+            raise ValueError('Max cita date format error')
+        try:
+            self.time_windows: List[Tuple[int, int]] = []  # (first, last) minute of the day, both included
+            for window in time_windows:
+                first, last = window.split('-')
+                self.time_windows.append((parse_time(first), parse_time(last)))
+        except ValueError:
+            raise ValueError('Cita time window format error, must be HH:MM-HH:MM')
+        self.excluded_weekdays = set(excluded_weekdays)
+        if not self.excluded_weekdays <= set(range(7)):
+            raise ValueError('Excluded weekdays must be 0 (Monday) to 6 (Sunday)')
+        if rank not in ranks:
+            raise ValueError(f'Unknown cita rank: {rank}')
+        self.rank = rank
+        self.preferred_time = 0
+        if rank == 'closest':
+            try:
+                self.preferred_time = parse_time(preferred_time)
+            except ValueError:
+                raise ValueError('Preferred cita time format error')
+        self.dates = {}
+        self.times = {}
+
+    def date_key(self, s: str) -> Optional[int]:
+        try:
+            d = parse_date(s)
+        except ValueError:
+            return None
+        if not self.min_date <= d <= self.max_date or \
+                date(d // 10000, d // 100 % 100, d % 100).weekday() in self.excluded_weekdays:
+            return None
+        return d * 10000
+
+    def time_key(self, s: str) -> Optional[Tuple[int, int]]:
+        try:
+            t = parse_time(s)
+        except ValueError:
+            return None
+        if len(self.time_windows) != 0 and not any(first <= t <= last for first, last in self.time_windows):
+            return None
+        # closest: the distance to the preferred time outweighs any date, the earliest date breaks ties
+        return t, abs(t - self.preferred_time) * 10 ** 12 if self.rank == 'closest' else 0
+
+    def best(self, citas: Iterable[Cita]) -> str:
+        # the id of the best cita within the constraints, '' when there is none
+        dates, times = self.dates, self.times
+        sign = -1 if self.rank == 'latest' else 1
+        best_id, best_key = '', None
+        for cita in citas:
+            d = dates.get(cita.date, -1)
+            if d == -1:
+                d = dates[cita.date] = self.date_key(cita.date)
+            if d is None:
+                continue
+            t = times.get(cita.time, -1)
+            if t == -1:
+                t = times[cita.time] = self.time_key(cita.time)
+            if t is None:
+                continue
+            key = sign * (d + t[0]) + t[1]
+            if best_key is None or key < best_key:
+                best_id, best_key = cita.id, key
+        return best_id
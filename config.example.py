@@ -1,11 +1,41 @@
 from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
 
 
 @dataclass
 class App:
     google_maps_api_key: str = 'FSPJYsNILCTwkFy8xt6fUUNQqLVjK5K8Cqt7l4S'
-    sleep_minutes: int = 15
+    distance_provider: str = 'google'  # google or haversine (offline, needs Info.address_coordinates)
+    sleep_minutes: int = 15  # between attempts, with the fixed scheduler
+    scheduler: str = 'fixed'  # fixed, or adaptive (learns the hours citas get released, backs off on 503 errors)
+    schedule_min_minutes: float = 2  # adaptive: in the most productive hours
+    schedule_max_minutes: float = 30  # adaptive: in hours that never offered anything
+    schedule_attempts_per_hour: int = 20  # adaptive: request budget, 0 for none
+    schedule_history_path: str = 'attempts.db'
     chrome_profile_path: str = '/tmp/ChromeUserData'
+    chrome_debugger_address: str = ''  # e.g. 127.0.0.1:9222, attach to the Chrome chrome_launcher.py keeps up
+    supervise: bool = True  # recycle the browser and keep going after crashes, see supervisor.py
+    recycle_browser_rss_mb: int = 1500  # recycle the browser when its processes use more memory, 0 for never
+    recycle_browser_attempts: int = 0  # recycle the browser after this many attempts, 0 for never
+    restart_backoff_min_seconds: float = 10  # after a crash, doubling on every crash in a row
+    restart_backoff_max_seconds: float = 600
+    transport: str = 'browser'  # browser, or hybrid (look up over plain HTTP, the browser only books the cita)
+    hybrid_lazy_browser: bool = True  # with hybrid, start Chrome only once a cita is offered
+    http_engine: str = 'requests'  # with hybrid, requests or asyncio (needs aiohttp, streams and stops reading early)
+    extract_in_browser: bool = True
+    session_reset: str = 'cdp'  # cdp (clear cookies and storage, then one load) or reload (load, delete cookies, reload)
+    wait_with_observer: bool = True  # wait for elements with a MutationObserver instead of polling
+    wait_poll_interval: float = 0.05  # seconds, for the waits that still poll
+    block_requests: bool = False  # block images, fonts and trackers through CDP
+    blocked_url_patterns: Optional[List[str]] = None  # None for network.default_blocked_url_patterns
+    count_network: bool = True  # count bytes and requests per attempt
+    distance_cache_path: str = 'office_distances.db'
+    distance_cache_ttl_days: int = 90
+    office_catalog_path: str = 'offices.db'  # offices learned from the site, see office_catalog.py
+    history_path: str = 'availability.db'  # offices and citas offered, see history.py; empty to disable
+    corpus_path: str = ''  # e.g. corpus.db, every page source for replaying the parsers, see corpus.py
+    metrics_path: str = ''  # e.g. autocita.prom, empty to disable
+    metrics_format: str = 'prometheus'  # prometheus (text file) or jsonl
     debug: bool = False
 
 
@@ -18,7 +48,17 @@ class Info:
     phone: str = '657666666'
     current_expiry_date: str = '09/06/2021'
     address: str = 'Passeig de Sant Joan, 189'
+    address_coordinates: Optional[Tuple[float, float]] = (41.4019, 2.1668)  # (latitude, longitude)
+    travel_mode: str = 'driving'  # driving, walking, bicycling or transit
     offices_distances: dict = field(default_factory=dict)
     desired_office_code: int = -1
+    preferred_office_code: int = -1  # office tried first whenever it's offered
+    distance_weight: float = 1.0  # office ranking cost per meter
+    duration_weight: float = 0.0  # office ranking cost per second of travel time
     tramite_code: int = 4010
     max_cita_date: str = '06/09/2021'
+    min_cita_date: str = ''  # dd/mm/yyyy, empty for any
+    cita_time_windows: List[str] = field(default_factory=list)  # e.g. ['09:00-11:30', '16:00-18:00'], empty for any
+    excluded_weekdays: List[int] = field(default_factory=list)  # 0 is Monday, 6 is Sunday
+    cita_rank: str = 'earliest'  # earliest, latest, or closest (to preferred_cita_time, then earliest)
+    preferred_cita_time: str = ''  # HH:MM
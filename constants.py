@@ -5,12 +5,41 @@ base_url = 'https://sede.administracionespublicas.gob.es'
 no_cita_message = 'En este momento no hay citas disponibles.'
 error_503_message = 'ERROR [503]'
 nie_pattern = re.compile(r'^[XYZ]\d{7,8}[A-Z]$')
-hidden_params_pattern = re.compile(
-    r'><input type="hidden" name="([\da-f]{8}-[\da-f]{4}-[\da-f]{4}-[\da-f]{4}-[\da-f]{12})" value(?:="([\da-f]{8}-[\da-f]{4}-[\da-f]{4}-[\da-f]{4}-[\da-f]{12})")?/><input type="hidden" name="([\da-f]{8}-[\da-f]{4}-[\da-f]{4}-[\da-f]{4}-[\da-f]{12})" value(?:="([\da-f]{8}-[\da-f]{4}-[\da-f]{4}-[\da-f]{4}-[\da-f]{12})")?/>')
-offices_pattern = re.compile(r'<option value="(\d+)"\s?>(.+)</option>')
+uuid_pattern = re.compile(r'[\da-fA-F]{8}-[\da-fA-F]{4}-[\da-fA-F]{4}-[\da-fA-F]{4}-[\da-fA-F]{12}')
+# an attribute value holding a UUID, what the hidden parameter inputs are found by; the '=' is a literal to search
+# for, a case-insensitive 'name' before it would not be, the attribute is told apart once the tag is parsed
+uuid_attr_pattern = re.compile(
+    r'=\s*["\']?[\da-fA-F]{8}-[\da-fA-F]{4}-[\da-fA-F]{4}-[\da-fA-F]{4}-[\da-fA-F]{12}(?=["\'\s/>])')
+# a name attribute holding a UUID, in any case as HTML allows; too slow to search a page with on the hot path,
+# the corpus check uses it to tell whether a page should have hidden parameters at all
+uuid_name_pattern = re.compile(
+    r'name\s*=\s*["\']?[\da-f]{8}-[\da-f]{4}-[\da-f]{4}-[\da-f]{4}-[\da-f]{12}(?=["\'\s/>])', re.IGNORECASE)
+# one attribute of a tag, the value quoted, unquoted or missing; the alternatives can't overlap so it never backtracks
+html_attr_pattern = re.compile(r'([^\s=/>"\']+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>"\']+)))?')
+# the name stops at the next tag, so options on one line stay apart and an unclosed one can't backtrack
+offices_pattern = re.compile(r'<option value="(\d+)"\s?>([^<]*)</option>')
+# the gap between the number and the date never runs into the next cita, so every cita is scanned once
 cita_pattern = re.compile(
-    r'<span>CITA</span>\s*(\d+)[\s\S]+?Día</span>: <span>(\d{2}/\d{2}/\d{4})</span> <br(?: /)?> <span>Hora</span>: <span>(\d{2}:\d{2})</span> <br')
+    r'<span>CITA</span>\s*(\d+)(?:[^<]|<(?!span>CITA</span>))*?Día</span>: <span>(\d{2}/\d{2}/\d{4})</span> <br(?: /)?> <span>Hora</span>: <span>(\d{2}:\d{2})</span> <br')
 cita_code_pattern = re.compile(r'<span id="justificanteFinal" class="mf-carousel--item-title">([\dA-Z]+?)</span>')
+captcha_failed_marker = 'Captcha'
+sms_verification_marker = 'txtCodigoVerificacion'
+offices_marker = '<select id="idSede"'
+offices_end_marker = '</select>'
+form_end_marker = '</form>'
+cita_marker = '<span>CITA</span>'
+cita_code_marker = '<span id="justificanteFinal"'
+# what a page is classified by; each one is looked for with str.find, an alternation of them all is
+# tried at every position of the page and was 40 times slower
+page_markers = (
+    ('error_503', error_503_message),
+    ('no_cita', no_cita_message),
+    ('captcha_failed', captcha_failed_marker),
+    ('sms_verification', sms_verification_marker),
+    ('offices', offices_marker),
+    ('citas', cita_marker),
+    ('confirmation', cita_code_marker),
+)
 
 browser_headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/95.0.4638.54 Safari/537.36',
@@ -233,6 +262,7 @@ countries = {
     'ZAMBIA': 382,
     'ZIMBABWE': 357,
 }
+country_codes = frozenset(countries.values())
 
 tramites = {
     'POLICIA - RECOGIDA DE TARJETA DE IDENTIDAD DE EXTRANJERO (TIE)': 4036,
@@ -248,6 +278,7 @@ tramites = {
     'POLICÍA-EXP.TARJETA ASOCIADA AL ACUERDO DE RETIRADA CIUDADANOS BRITÁNICOS Y SUS FAMILIARES (BREXIT)': 4094,
     'POLICIA-CERTIFICADOS Y ASIGNACION NIE': 4096,
 }
+tramite_codes = frozenset(tramites.values())
 
 office_codes = {
     'CNP CARTAS DE INVITACION, CALLE GUADALAJARA , 1': 48,
@@ -282,6 +313,40 @@ office_codes = {
     'PASSEIG DE SANT JOAN, PASSEIG DE SANT JOAN, 189': 6,
 }
 
+# approximate (latitude, longitude) of every office in office_codes, for ranking offices without network
+office_coordinates = {
+    'CNP CARTAS DE INVITACION, CALLE GUADALAJARA , 1': (41.4232, 2.1839),
+    'CNP COMISARIA BADALONA, AVDA. DELS VENTS, 9': (41.4489, 2.2349),
+    'CNP COMISARIA CASTELLDEFELS, PLAÇA DE L`ESPERANTO, 4': (41.2803, 1.9762),
+    'CNP COMISARIA CERDANYOLA DEL VALLES, VERGE DE LES FEIXES, 4': (41.4911, 2.1403),
+    'CNP COMISARIA CORNELLA DE LLOBREGAT, AV. SANT ILDEFONS, S/N': (41.3497, 2.0794),
+    'CNP COMISARIA EL PRAT DE LLOBREGAT, CENTRE, 4': (41.3262, 2.0953),
+    'CNP COMISARIA GRANOLLERS, RICOMA, 65': (41.6083, 2.2874),
+    'CNP COMISARIA IGUALADA, PRAT DE LA RIBA, 13': (41.5791, 1.6172),
+    'CNP COMISARIA LHOSPITALET DE LLOBREGAT, Rbla. Just Oliveres, 43': (41.3597, 2.0997),
+    'CNP COMISARIA MANRESA, SOLER I MARCH, 5': (41.7251, 1.8242),
+    'CNP COMISARIA MATARO, AV. GATASSA, 15': (41.5462, 2.4312),
+    'CNP COMISARIA MONTCADA I REIXAC, MAJOR, 38': (41.4831, 2.1872),
+    'CNP COMISARIA RIPOLLET, TAMARIT, 78': (41.4968, 2.1571),
+    'CNP COMISARIA RUBI, TERRASSA, 16': (41.4929, 2.0327),
+    'CNP COMISARIA SABADELL, BATLLEVELL, 115': (41.5531, 2.0992),
+    'CNP COMISARIA SANT ADRIA DEL BESOS, AV. JOAN XXIII, 2': (41.4302, 2.2188),
+    'CNP COMISARIA SANT BOI DE LLOBREGAT, RIERA BASTÉ, 43': (41.3441, 2.0381),
+    'CNP COMISARIA SANT CUGAT DEL VALLES, VALLES, 1': (41.4722, 2.0833),
+    'CNP COMISARIA SANT FELIU DE LLOBREGAT, CARRERETES, 9': (41.3811, 2.0452),
+    'CNP COMISARIA SANTA COLOMA DE GRAMENET, IRLANDA, 67': (41.4528, 2.2081),
+    'CNP COMISARIA TERRASSA, BALDRICH, 13': (41.5612, 2.0139),
+    'CNP COMISARIA VIC, BISBE MORGADES, 4': (41.9301, 2.2543),
+    'CNP COMISARIA VILADECANS, AVDA. BALLESTER, 2': (41.3152, 2.0141),
+    'CNP COMISARIA VILAFRANCA DEL PENEDES, Avinguda Ronda del Mar, 109': (41.3448, 1.6991),
+    'CNP COMISARIA VILANOVA I LA GELTRU, VAPOR, 19': (41.2232, 1.7251),
+    'CNP MALLORCA GRANADOS, MALLORCA, 213': (41.3908, 2.1582),
+    'CNP PSJ PLANTA BAJA, PASSEIG SANT JOAN, 189': (41.4019, 2.1668),
+    'CNP RAMBLA GUIPUSCOA 74, RAMBLA GUIPUSCOA, 74': (41.4168, 2.1991),
+    'OUE BCN-C/MURCIA, 42, MURCIA, 42': (41.4216, 2.1871),
+    'PASSEIG DE SANT JOAN, PASSEIG DE SANT JOAN, 189': (41.4019, 2.1668),
+}
+
 
 class CountryNotFoundError(Exception):
     pass
@@ -305,3 +370,7 @@ class FailedAttempt(Exception):
 
 class FailedAttemptAtOffice(Exception):
     pass
+
+
+class ServerError(FailedAttempt):
+    pass
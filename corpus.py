@@ -0,0 +1,216 @@
+import argparse
+import hashlib
+import re
+import sqlite3
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from time import perf_counter, time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from constants import uuid_pattern, uuid_name_pattern, offices_marker, offices_end_marker
+from page import PageKind, PageScanner, parse_page, extract_hidden_params
+from cita_selector import CitaSelector
+
+option_value_pattern = re.compile(r'<option value="\d+"')
+cita_radio_pattern = re.compile(r'name="rdbCita"')
+
+
+def normalize(html: str, redact: Iterable[str] = ()) -> str:
+    # every session UUID becomes a fixed one by order of appearance, and personal data is blanked,
+    # so the same page served to different sessions is stored once and the corpus can be shared
+    uuids: Dict[str, str] = {}
+
+    def replace(m: re.Match) -> str:
+        u = m.group(0).lower()
+        if u not in uuids:
+            uuids[u] = f'00000000-0000-4000-8000-{len(uuids) + 1:012d}'
+        return uuids[u]
+
+    html = uuid_pattern.sub(replace, html)
+    for s in redact:
+        if s:
+            html = html.replace(s, 'X' * len(s))
+    return html
+
+
+class PageCorpus:
+    # page sources of every step, for replaying the parsers offline: sources (digest, zlib-compressed html),
+    # stored once however many times they were served, and pages (at, step, digest, plus what the parser
+    # made of them at capture time); rows are buffered during an attempt and written once it's over
+    pending: List[Tuple[float, str, str]]
+
+    def __init__(self, path: str, redact: Iterable[str] = ()):
+        self.redact = [s for s in redact if s]
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS sources ('
+                              'digest BLOB PRIMARY KEY, html BLOB NOT NULL) WITHOUT ROWID')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS pages ('
+                              'at REAL NOT NULL, step TEXT NOT NULL, digest BLOB NOT NULL, kind TEXT NOT NULL, '
+                              'offices INTEGER NOT NULL, citas INTEGER NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS pages_step ON pages (step, at)')
+        self.pending = []
+
+    def record(self, step: str, html: str, at: Optional[float] = None):
+        self.pending.append((time() if at is None else at, step, html))
+
+    def flush(self):
+        # normalized, parsed and compressed only now, not while the attempt is running
+        if len(self.pending) == 0:
+            return
+        pages = []
+        sources = {}
+        for at, step, html in self.pending:
+            html = normalize(html, self.redact)
+            digest = hashlib.sha1(html.encode('utf-8')).digest()
+            page = parse_page(html)
+            pages.append((at, step, digest, page.kind.value, len(page.offices), len(page.citas)))
+            if digest not in sources and \
+                    self.conn.execute('SELECT 1 FROM sources WHERE digest = ?', (digest,)).fetchone() is None:
+                sources[digest] = zlib.compress(html.encode('utf-8'), 9)
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO sources (digest, html) VALUES (?, ?)', sources.items())
+            self.conn.executemany('INSERT INTO pages (at, step, digest, kind, offices, citas) '
+                                  'VALUES (?, ?, ?, ?, ?, ?)', pages)
+        self.pending = []
+
+    def pages(self, step: Optional[str] = None, since: float = 0) -> Iterator[Tuple[float, str, str, str, int, int]]:
+        # (at, step, html, kind, offices, citas) as recorded, oldest first
+        query = 'SELECT at, step, html, kind, offices, citas FROM pages JOIN sources USING (digest) WHERE at >= ?'
+        args = [since]
+        if step is not None:
+            query += ' AND step = ?'
+            args.append(step)
+        for at, step, html, kind, offices, citas in self.conn.execute(query + ' ORDER BY at', args):
+            yield at, step, zlib.decompress(html).decode('utf-8'), kind, offices, citas
+
+    def stats(self) -> Dict[str, Tuple[int, int]]:
+        # step -> (pages, distinct sources)
+        rows = self.conn.execute('SELECT step, COUNT(*), COUNT(DISTINCT digest) FROM pages GROUP BY step')
+        return {step: (n, distinct) for step, n, distinct in rows}
+
+    def size(self) -> Tuple[int, int]:
+        # (distinct sources, compressed bytes)
+        return self.conn.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(html)), 0) FROM sources').fetchone()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+# the pages the parsers are checked against, by the step that was served them
+expected_kinds = {
+    'acCitar': (PageKind.OFFICES, PageKind.NO_CITA, PageKind.OTHER),
+    'acOfertarCita': (PageKind.CITAS, PageKind.NO_CITA),
+    'acVerificarCita': (PageKind.CAPTCHA_FAILED, PageKind.SMS_VERIFICATION, PageKind.OTHER),
+}
+
+
+def check_page(step: str, html: str, kind: str, offices: int, citas: int) -> List[str]:
+    # what the current parsers get wrong about a recorded page, empty if nothing
+    problems = []
+    page = parse_page(html)
+    if page.kind.value != kind or len(page.offices) != offices or len(page.citas) != citas:
+        problems.append(f'parsed as {page.kind.value} with {len(page.offices)} offices and {len(page.citas)} citas, '
+                        f'recorded as {kind} with {offices} offices and {citas} citas')
+    if step in expected_kinds and page.kind not in expected_kinds[step]:
+        problems.append(f'{page.kind.value} page at {step}')
+
+    # counted in the simplest possible way, independently of the parsers
+    if page.kind == PageKind.OFFICES:
+        start = html.find(offices_marker)
+        end = html.find(offices_end_marker, start)
+        n = len(option_value_pattern.findall(html, start, end if end != -1 else len(html)))
+        if n != len(page.offices):
+            problems.append(f'{len(page.offices)} offices parsed out of {n} options')
+    if page.kind == PageKind.CITAS:
+        n = len(cita_radio_pattern.findall(html))
+        if n != len(page.citas):
+            problems.append(f'{len(page.citas)} citas parsed out of {n} radios')
+        for cita in page.citas:
+            try:
+                datetime.strptime(f'{cita.date} {cita.time}', '%d/%m/%Y %H:%M')
+            except ValueError:
+                problems.append(f'unparsable cita {cita!r}')
+        if len(page.citas) != 0 and CitaSelector().best(page.citas) == '':
+            problems.append('no cita chosen without constraints')
+    if page.kind not in (PageKind.ERROR_503, PageKind.CONFIRMATION) and uuid_name_pattern.search(html) is not None \
+            and extract_hidden_params(html) is None:
+        problems.append('hidden parameters not extracted')
+
+    # streamed in small chunks, the scanner must agree with the whole page parser
+    scanner = PageScanner(page.kind if page.kind in (PageKind.OFFICES, PageKind.CITAS) else PageKind.OTHER)
+    for i in range(0, len(html), 1024):
+        if scanner.feed(html[i:i + 1024]):
+            break
+    streamed = scanner.page()
+    if streamed.kind != page.kind or len(streamed.offices) != len(page.offices) or \
+            len(streamed.citas) != len(page.citas):
+        problems.append(f'streamed as {streamed.kind.value} with {len(streamed.offices)} offices and '
+                        f'{len(streamed.citas)} citas')
+    return problems
+
+
+def throughput(pages: List[Tuple[str, str]], repeat: int = 3) -> Dict[str, Tuple[int, int, float]]:
+    # step -> (pages, bytes, best seconds to parse them all, hidden parameters and cita choice included)
+    by_step: Dict[str, List[str]] = defaultdict(list)
+    for step, html in pages:
+        by_step[step].append(html)
+    results = {}
+    for step, htmls in by_step.items():
+        best = float('inf')
+        for _ in range(repeat):
+            selector = CitaSelector()  # its caches start empty on every repeat
+            started = perf_counter()
+            for html in htmls:
+                page = parse_page(html)
+                extract_hidden_params(html)
+                selector.best(page.citas)
+            best = min(best, perf_counter() - started)
+        results[step] = (len(htmls), sum(len(html) for html in htmls), best)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the parsers over the recorded page sources')
+    parser.add_argument('command', choices=['replay', 'stats', 'show'])
+    parser.add_argument('--path', default='corpus.db')
+    parser.add_argument('--step', help='only the pages served at this step')
+    parser.add_argument('--days', type=float, default=0, help='only the pages of the last days, 0 for all')
+    parser.add_argument('--limit', type=int, default=20, help='problems to print')
+    args = parser.parse_args()
+
+    corpus = PageCorpus(args.path)
+    since = time() - args.days * 24 * 3600 if args.days > 0 else 0
+    if args.command == 'stats':
+        for step, (n, distinct) in sorted(corpus.stats().items()):
+            print(f'{step:<20}{n:>8} pages{distinct:>8} distinct')
+        distinct, compressed = corpus.size()
+        print(f'{distinct} distinct pages in {compressed / 1024:.1f} KB')
+    elif args.command == 'show':
+        # the latest recorded page, e.g. to look at what went wrong
+        latest = None
+        for latest in corpus.pages(args.step, since):
+            pass
+        if latest is not None:
+            print(latest[2])
+    else:
+        pages = []
+        failed = 0
+        for at, step, html, kind, offices, citas in corpus.pages(args.step, since):
+            pages.append((step, html))
+            problems = check_page(step, html, kind, offices, citas)
+            if len(problems) != 0:
+                failed += 1
+                if failed <= args.limit:
+                    when = datetime.fromtimestamp(at).strftime('%Y-%m-%d %H:%M:%S')
+                    print(f'[FAILED] {step} at {when}: ' + '; '.join(problems))
+        print(f'{len(pages) - failed}/{len(pages)} pages parsed correctly')
+        for step, (n, size, seconds) in sorted(throughput(pages).items()):
+            print(f'{step:<20}{n:>8} pages{n / seconds:>12.0f} pages/s{size / seconds / 1e6:>10.1f} MB/s')
+    corpus.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import sqlite3
+from time import time
+from typing import Dict, Iterable, Optional, Tuple
+
+Route = Tuple[int, Optional[int]]  # (distance in meters, duration in seconds if known)
+
+
+class DistanceCache:
+    # routes keyed by (origin address, office name, travel mode), persisted in SQLite;
+    # a NULL distance means Google found no route, so that office isn't asked for again either
+
+    def __init__(self, path: str, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS distances ('
+                              'origin TEXT NOT NULL, office TEXT NOT NULL, mode TEXT NOT NULL, '
+                              'distance INTEGER, fetched_at REAL NOT NULL, duration INTEGER, '
+                              'PRIMARY KEY (origin, office, mode))')
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(distances)')]
+            if 'duration' not in columns:  # caches written before durations were stored
+                self.conn.execute('ALTER TABLE distances ADD COLUMN duration INTEGER')
+
+    def get_all(self, origin: str, mode: str) -> Dict[str, Optional[int]]:
+        return {name: None if route is None else route[0] for name, route in self.get_routes(origin, mode).items()}
+
+    def get_routes(self, origin: str, mode: str) -> Dict[str, Optional[Route]]:
+        rows = self.conn.execute('SELECT office, distance, duration FROM distances '
+                                 'WHERE origin = ? AND mode = ? AND fetched_at >= ?',
+                                 (origin, mode, time() - self.ttl_seconds))
+        return {name: None if distance is None else (distance, duration) for name, distance, duration in rows}
+
+    def missing(self, origin: str, mode: str, offices: Iterable[str]) -> list:
+        cached = self.get_routes(origin, mode)
+        return [name for name in offices if name not in cached]
+
+    def put_many(self, origin: str, mode: str, distances: Dict[str, Optional[int]], overwrite: bool = True):
+        self.put_routes(origin, mode, {name: None if distance is None else (distance, None)
+                                       for name, distance in distances.items()}, overwrite)
+
+    def put_routes(self, origin: str, mode: str, routes: Dict[str, Optional[Route]], overwrite: bool = True):
+        # all rows of a batch are written in one transaction, readers never see half of it
+        now = time()
+        verb = 'INSERT OR REPLACE' if overwrite else 'INSERT OR IGNORE'
+        with self.conn:
+            self.conn.executemany(f'{verb} INTO distances (origin, office, mode, distance, duration, fetched_at) '
+                                  f'VALUES (?, ?, ?, ?, ?, ?)',
+                                  [(origin, name, mode, None, None, now) if route is None else
+                                   (origin, name, mode, route[0], route[1], now) for name, route in routes.items()])
+
+    def close(self):
+        self.conn.close()
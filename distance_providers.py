@@ -0,0 +1,146 @@
+import math
+import requests
+from time import sleep
+from typing import Dict, List, Optional, Tuple
+from constants import office_coordinates
+from distance_cache import Route
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the local provider falls back to plain Python
+    np = None
+
+earth_radius = 6371008.8  # meters
+
+
+class DistanceProvider:
+    # mode is part of the distance cache key, cacheable tells whether results are worth persisting
+    mode: str
+    cacheable: bool
+
+    def get_routes(self, address: str, office_names: List[str]) -> Dict[str, Optional[Route]]:
+        # (distance in meters, duration in seconds), None when there is no route to the office;
+        # an office the provider knows nothing about is left out
+        raise NotImplementedError
+
+    def get_distances(self, address: str, office_names: List[str]) -> Dict[str, Optional[int]]:
+        return {name: None if route is None else route[0]
+                for name, route in self.get_routes(address, office_names).items()}
+
+
+class GoogleDistanceProvider(DistanceProvider):
+    cacheable = True
+    api_url = 'https://maps.googleapis.com/maps/api/distancematrix/json'
+    transient_statuses = ('OVER_QUERY_LIMIT', 'UNKNOWN_ERROR')
+
+    def __init__(self, google_maps_api_key: str, mode: str = 'driving', batch_size: int = 25,
+                 session: Optional[requests.Session] = None, api_url: Optional[str] = None,
+                 retries: int = 3, backoff_seconds: float = 1.0, timeout_seconds: float = 10.0):
+        self.google_maps_api_key = google_maps_api_key
+        self.mode = mode
+        self.batch_size = batch_size
+        # a shared session keeps connections to the API alive between batches
+        self.session = session if session is not None else requests.Session()
+        if api_url is not None:
+            self.api_url = api_url
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout_seconds = timeout_seconds
+
+    def get_routes(self, address: str, office_names: List[str]) -> Dict[str, Optional[Route]]:
+        routes = {}
+        for i in range(0, len(office_names), self.batch_size):
+            routes |= self.get_routes_batch(address, office_names[i:i + self.batch_size])
+        return routes
+
+    def get_routes_batch(self, address: str, office_names: List[str]) -> Dict[str, Optional[Route]]:
+        params = {'key': self.google_maps_api_key, 'language': 'en', 'region': 'es', 'mode': self.mode,
+                  'origins': address, 'destinations': '|'.join(office_names)}
+        for attempt in range(self.retries + 1):
+            if attempt != 0:
+                sleep(self.backoff_seconds * 2 ** (attempt - 1))
+            try:
+                r = self.session.get(self.api_url, params=params, timeout=self.timeout_seconds)
+            except requests.RequestException as e:
+                error = f'Google DistanceMatrix API error: {e}'
+                continue
+            if r.status_code >= 500 or r.status_code == 429:
+                error = f'Google DistanceMatrix API error: HTTP {r.status_code}'
+                continue
+            try:
+                resp = r.json()
+            except ValueError as e:
+                raise Exception(f'Google DistanceMatrix API error: {e}')
+            if resp['status'] in self.transient_statuses:
+                error = f'Google DistanceMatrix API error: {resp["status"]}'
+                continue
+            if resp['status'] != 'OK' or len(resp['rows']) == 0:
+                raise Exception(f'Google DistanceMatrix API error: {resp["status"]}')
+            return self.parse_routes(resp, office_names)
+        raise Exception(error)
+
+    @staticmethod
+    def parse_routes(resp: dict, office_names: List[str]) -> Dict[str, Optional[Route]]:
+        routes = {}
+        for i, e in enumerate(resp['rows'][0]['elements']):
+            if e['status'] != 'OK':
+                print(f'No route to office {office_names[i]}')
+                routes[office_names[i]] = None
+            else:
+                routes[office_names[i]] = (e['distance']['value'], e['duration']['value'])
+        return routes
+
+
+class HaversineDistanceProvider(DistanceProvider):
+    # great-circle distances from the bundled office coordinates, no network involved
+    mode = 'haversine'
+    cacheable = False
+
+    def __init__(self, origin: Tuple[float, float], office_coordinates: Dict[str, Tuple[float, float]],
+                 speed: float = 8.0):
+        self.speed = speed  # meters per second, for a rough duration estimate
+        self.origin = (math.radians(origin[0]), math.radians(origin[1]))
+        self.office_index = {name: i for i, name in enumerate(office_coordinates)}
+        coordinates = [(math.radians(lat), math.radians(lng)) for lat, lng in office_coordinates.values()]
+        if np is not None:
+            # every office's distance is computed once here, lookups are just indexing
+            lat = np.array([c[0] for c in coordinates])
+            lng = np.array([c[1] for c in coordinates])
+            a = np.sin((lat - self.origin[0]) / 2) ** 2 + \
+                math.cos(self.origin[0]) * np.cos(lat) * np.sin((lng - self.origin[1]) / 2) ** 2
+            self.distances = (2 * earth_radius * np.arcsin(np.sqrt(a))).round().astype(int).tolist()
+        else:
+            self.distances = [self.haversine(self.origin, c) for c in coordinates]
+
+    @staticmethod
+    def haversine(a: Tuple[float, float], b: Tuple[float, float]) -> int:
+        h = math.sin((b[0] - a[0]) / 2) ** 2 + math.cos(a[0]) * math.cos(b[0]) * math.sin((b[1] - a[1]) / 2) ** 2
+        return round(2 * earth_radius * math.asin(math.sqrt(h)))
+
+    def get_routes(self, address: str, office_names: List[str]) -> Dict[str, Optional[Route]]:
+        routes = {}
+        for name in office_names:
+            i = self.office_index.get(name)
+            if i is None:
+                # not the same as no route, the office may well be the nearest one
+                print(f'No coordinates for office {name}')
+            else:
+                routes[name] = (self.distances[i], round(self.distances[i] / self.speed))
+        return routes
+
+
+def make_distance_providers(provider: str, google_maps_api_key: str, travel_mode: str,
+                            address_coordinates: Optional[Tuple[float, float]]) \
+        -> Tuple[DistanceProvider, Optional[DistanceProvider]]:
+    # returns the configured provider and, if the address coordinates are known, a local fallback for it
+    local = None
+    if address_coordinates is not None:
+        local = HaversineDistanceProvider(address_coordinates, office_coordinates)
+    if provider == 'google':
+        # only ever called by distance_resolver.py, off the booking path, so it can afford to retry
+        return GoogleDistanceProvider(google_maps_api_key, travel_mode), local
+    if provider == 'haversine':
+        if local is None:
+            raise ValueError('Address coordinates are needed for haversine distances')
+        return local, None
+    raise ValueError(f'Unknown distance provider: {provider}')
@@ -0,0 +1,71 @@
+import queue
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from distance_cache import DistanceCache, Route
+from distance_providers import DistanceProvider
+
+
+class DistanceResolver:
+    # looks routes up in a thread of its own, so the distance API is never waited for during an attempt:
+    # office names are submitted, the worker fetches them, writes them to the cache through a connection of
+    # its own and hands them back; the main thread picks them up with collect() whenever it ranks offices
+    pending: Set[str]  # submitted and not collected yet, only used by the main thread
+    unanswered: Set[str]  # the provider knows nothing about them, e.g. no coordinates, not asked for again
+    requests: 'queue.Queue[Optional[List[str]]]'
+    results: 'queue.Queue[Tuple[List[str], Dict[str, Optional[Route]], bool]]'  # (names, routes, failed)
+
+    def __init__(self, address: str, provider: DistanceProvider, cache: Optional[DistanceCache]):
+        self.address = address
+        self.provider = provider
+        self.cache = cache if provider.cacheable else None
+        self.pending = set()
+        self.unanswered = set()
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='distance-resolver', daemon=True)
+        self.thread.start()
+
+    def submit(self, names: Iterable[str]):
+        names = [name for name in names if name not in self.pending and name not in self.unanswered]
+        if len(names) != 0:
+            self.pending.update(names)
+            self.requests.put(names)
+
+    def collect(self) -> Dict[str, Optional[Route]]:
+        # the routes resolved since the last call, never blocks
+        routes = {}
+        while True:
+            try:
+                names, resolved, failed = self.results.get_nowait()
+            except queue.Empty:
+                break
+            routes |= resolved
+            # failed names are submitted again the next time they are offered
+            self.pending.difference_update(names)
+            if not failed:
+                self.unanswered.update(name for name in names if name not in resolved)
+        return routes
+
+    def run(self):
+        while True:
+            names = self.requests.get()
+            if names is None:
+                break
+            try:
+                routes = self.provider.get_routes(self.address, names)
+                if self.cache is not None:
+                    # write back, so every route is only fetched once
+                    self.cache.put_routes(self.address, self.provider.mode, routes)
+            except Exception as e:
+                # the offices keep their estimates, or stay last, until they're offered again
+                print(f'[WARNING] Failed to look up distances: {e}')
+                self.results.put((names, {}, True))
+                continue
+            self.results.put((names, routes, False))
+
+    def close(self, timeout: float = 5):
+        # a lookup still running is abandoned, the thread is a daemon
+        self.requests.put(None)
+        self.thread.join(timeout)
+        if self.cache is not None and not self.thread.is_alive():
+            self.cache.close()
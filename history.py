@@ -0,0 +1,113 @@
+import argparse
+import sqlite3
+from datetime import datetime
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from page import Cita, Office
+
+
+class AvailabilityHistory:
+    # every office and cita the site offered, as tiny integer rows in SQLite: offices (at, office) and
+    # citas (at, office, day as yyyymmdd, minute of the day); rows are buffered during an attempt and written
+    # in one transaction once it's over, so recording costs the booking steps nothing
+    pending_offices: List[Tuple[int, int]]
+    pending_citas: List[Tuple[int, int, int, int]]
+    pending_names: Dict[int, str]
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS offices ('
+                              'at INTEGER NOT NULL, office INTEGER NOT NULL, PRIMARY KEY (at, office)) WITHOUT ROWID')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS citas ('
+                              'at INTEGER NOT NULL, office INTEGER NOT NULL, day INTEGER NOT NULL, '
+                              'minute INTEGER NOT NULL, PRIMARY KEY (at, office, day, minute)) WITHOUT ROWID')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS citas_office ON citas (office, at)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS office_names ('
+                              'office INTEGER PRIMARY KEY, name TEXT NOT NULL)')
+        self.pending_offices = []
+        self.pending_citas = []
+        self.pending_names = {}
+
+    def record_offices(self, offices: Iterable[Office], at: Optional[float] = None):
+        at = int(time() if at is None else at)
+        for office in offices:
+            self.pending_offices.append((at, int(office.id)))
+            self.pending_names[int(office.id)] = office.name
+
+    def record_citas(self, office_id: int, citas: Iterable[Cita], at: Optional[float] = None):
+        at = int(time() if at is None else at)
+        for cita in citas:
+            d, m, y = cita.date.split('/')
+            h, mi = cita.time.split(':')
+            self.pending_citas.append((at, office_id, int(y + m + d), int(h) * 60 + int(mi)))
+
+    def flush(self):
+        if len(self.pending_offices) == 0 and len(self.pending_citas) == 0:
+            return
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO offices (at, office) VALUES (?, ?)', self.pending_offices)
+            self.conn.executemany('INSERT OR IGNORE INTO citas (at, office, day, minute) VALUES (?, ?, ?, ?)',
+                                  self.pending_citas)
+            self.conn.executemany('INSERT OR REPLACE INTO office_names (office, name) VALUES (?, ?)',
+                                  self.pending_names.items())
+        self.pending_offices = []
+        self.pending_citas = []
+        self.pending_names = {}
+
+    def names(self) -> Dict[int, str]:
+        return dict(self.conn.execute('SELECT office, name FROM office_names'))
+
+    def earliest_citas(self, since: float) -> Dict[int, Tuple[str, str]]:
+        # office -> earliest (date, time) offered since then
+        rows = self.conn.execute('SELECT office, MIN(day * 10000 + minute) FROM citas WHERE at >= ? GROUP BY office',
+                                 (int(since),))
+        return {office: (f'{v // 10000 % 100:02d}/{v // 1000000 % 100:02d}/{v // 100000000}',
+                         f'{v % 10000 // 60:02d}:{v % 10000 % 60:02d}') for office, v in rows}
+
+    def office_hours(self, since: float) -> Dict[int, Dict[int, int]]:
+        # office -> local hour of the day -> attempts it was offered in
+        rows = self.conn.execute("SELECT office, CAST(strftime('%H', at, 'unixepoch', 'localtime') AS INTEGER), "
+                                 "COUNT(DISTINCT at) FROM offices WHERE at >= ? GROUP BY 1, 2", (int(since),))
+        hours: Dict[int, Dict[int, int]] = {}
+        for office, hour, count in rows:
+            hours.setdefault(office, {})[hour] = count
+        return hours
+
+    def cita_hours(self, since: float) -> Dict[int, int]:
+        # local hour of the day -> attempts any cita was offered in
+        rows = self.conn.execute("SELECT CAST(strftime('%H', at, 'unixepoch', 'localtime') AS INTEGER), "
+                                 "COUNT(DISTINCT at) FROM citas WHERE at >= ? GROUP BY 1", (int(since),))
+        return dict(rows)
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the offices and citas the site offered')
+    parser.add_argument('query', choices=['earliest', 'office-hours', 'cita-hours'])
+    parser.add_argument('--days', type=float, default=7, help='look this many days back')
+    parser.add_argument('--path', default='availability.db')
+    args = parser.parse_args()
+
+    history = AvailabilityHistory(args.path)
+    since = time() - args.days * 24 * 3600
+    names = history.names()
+    if args.query == 'earliest':
+        for office, (date, hour) in sorted(history.earliest_citas(since).items(),
+                                           key=lambda i: datetime.strptime(i[1][0], '%d/%m/%Y')):
+            print(f'{date} {hour}  {names.get(office, office)}')
+    elif args.query == 'office-hours':
+        for office, hours in sorted(history.office_hours(since).items()):
+            print(f'{names.get(office, office)}: ' + ', '.join(f'{h:02d}h x{n}' for h, n in sorted(hours.items())))
+    else:
+        for hour, count in sorted(history.cita_hours(since).items()):
+            print(f'{hour:02d}h {count}')
+    history.close()
+
+
+if __name__ == '__main__':
+    main()
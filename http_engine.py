@@ -0,0 +1,140 @@
+import re
+import requests
+from typing import Callable, Dict, Optional, Tuple, Union
+from constants import *
+from page import Page, PageKind, parse_page, extract_hidden_params
+
+head_pattern = re.compile(r'<head[^>]*>', re.IGNORECASE)
+
+
+class HttpEngine:
+    # the lookup steps of the booking flow (citar to acOfertarCita) over plain HTTP, like old.py,
+    # so a browser is only needed once a cita is offered
+    r: requests.Session
+    session_params: Dict[str, Union[str, Tuple[None, str]]]  # hidden UUIDs
+    last_url: str
+    last_page: Page
+    office_id: str
+    cita_id: str
+
+    def __init__(self, base_url: str, nie: str, full_name: str, country_code: str, exp: str, email: str, phone: str,
+                 tramite_code: int, desired_office_code: int, choose_office_id: Callable[[Page], str],
+                 choose_cita_id: Callable[[Page], str], timeout: float = 30,
+                 capture: Optional[Callable[[str, str], None]] = None):
+        self.base_url = base_url
+        self.nie = nie
+        self.full_name = full_name
+        self.country_code = country_code
+        self.exp = exp
+        self.email = email
+        self.phone = phone
+        self.tramite_code = tramite_code
+        self.desired_office_code = desired_office_code
+        self.choose_office_id = choose_office_id
+        self.choose_cita_id = choose_cita_id
+        self.timeout = timeout
+        self.capture = capture  # called with (step, html) of every response
+
+    def post(self, step: str, **kwargs) -> Page:
+        url = f'{self.base_url}/icpplustieb/{step}'
+        try:
+            resp = self.r.post(url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise FailedAttempt(f'{step} request failed: {e}')
+        if self.capture is not None:
+            self.capture(step, resp.text)
+        self.r.headers.update({'Referer': url})
+        self.last_url = url
+        self.last_page = parse_page(resp.text)
+        return self.last_page
+
+    def init_session(self):
+        self.r = requests.Session()
+        self.r.headers.update(browser_headers)
+
+    def citar(self):
+        self.init_session()
+        url = f'{self.base_url}/icpplustieb/citar?p=8&locale=es'
+        try:
+            resp = self.r.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise FailedAttempt(f'citar request failed: {e}')
+        if self.capture is not None:
+            self.capture('citar', resp.text)
+        page = parse_page(resp.text)
+        if page.kind == PageKind.ERROR_503:
+            raise ServerError('Server 503 error')
+        self.update_session_params(page.html)
+        self.r.headers.update({'Referer': url, 'Origin': self.base_url, 'Cache-Control': 'max-age=0'})
+
+    def acInfo(self):
+        page = self.post('acInfo', data=self.session_params | self.info_fields())
+        self.update_session_params(page.html)
+
+    def acEntrada(self):
+        page = self.post('acEntrada', data=self.session_params)
+        self.update_session_params(page.html)
+
+    def acValidarEntrada(self):
+        # multipart/form-data, like the browser sends it
+        page = self.post('acValidarEntrada', files={k: (None, v) for k, v in
+                                                    (self.session_params | self.validar_entrada_fields()).items()})
+        self.update_session_params(page.html)
+
+    def acCitar(self):
+        page = self.post('acCitar', data=self.session_params)
+        self.office_id = self.choose_office_id(page)  # '' for recogida de tarjeta, there is no office to choose
+        self.update_session_params(page.html)
+
+    def acVerFormulario(self):
+        if self.office_id == '':
+            return
+        page = self.post('acVerFormulario', data=self.session_params | {'idSede': self.office_id})
+        self.update_session_params(page.html)
+
+    def acOfertarCita(self):
+        # the chosen cita id is left in cita_id and the offered page in last_page, for the browser to take over
+        page = self.post('acOfertarCita', data=self.session_params | self.contact_fields())
+        self.cita_id = self.choose_cita_id(page)
+        self.update_session_params(page.html)
+
+    @property
+    def lookup_steps(self) -> tuple:
+        return self.citar, self.acInfo, self.acEntrada, self.acValidarEntrada, self.acCitar, self.acVerFormulario, \
+            self.acOfertarCita
+
+    def info_fields(self) -> Dict[str, str]:
+        sede = str(self.desired_office_code) if self.desired_office_code != -1 else '99'  # 99: any office
+        return {'sede': sede, 'tramiteGrupo[0]': str(self.tramite_code)}
+
+    def validar_entrada_fields(self) -> Dict[str, str]:
+        fields = {'rdbTipoDoc': 'N.I.E.', 'txtIdCitado': self.nie, 'txtDesCitado': self.full_name}
+        if self.tramite_code == 4010:  # toma de huellas
+            fields |= {'txtPaisNac': self.country_code, 'txtFecha': self.exp}
+        elif self.tramite_code != 4036:  # recogida de tarjeta
+            raise UnsupportedTramiteError
+        return fields
+
+    def contact_fields(self) -> Dict[str, str]:
+        return {'txtMailCitado': self.email, 'emailDOS': self.email, 'txtTelefonoCitado': self.phone}
+
+    def cookies(self) -> list:
+        # session cookies in the shape of CDP's Network.setCookie
+        return [{'name': c.name, 'value': c.value, 'url': self.base_url, 'path': c.path or '/',
+                 'secure': bool(c.secure), 'httpOnly': c.has_nonstandard_attr('HttpOnly')} for c in self.r.cookies]
+
+    def offered_html(self) -> str:
+        # the offered page with a base, so relative links and the form action resolve against the sede
+        base = f'<base href="{self.last_url.rsplit("/", 1)[0]}/">'
+        html = self.last_page.html
+        m = head_pattern.search(html)
+        if m is None:
+            return base + html
+        return html[:m.end()] + base + html[m.end():]
+
+    def update_session_params(self, html: str):
+        hidden_params = extract_hidden_params(html)
+        if hidden_params is None:
+            print(html)
+            raise Exception('Can\'t extract hidden parameters')
+        self.session_params = hidden_params
@@ -1,15 +1,33 @@
+import asyncio
 import json
-import requests
-from typing import Set, Dict
-from time import sleep
+from typing import Callable, List, Optional
+from time import perf_counter, sleep
 from datetime import datetime
 from selenium import webdriver
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait, Select
-from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import Select
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from constants import *
 from config import App, Info
+from distance_cache import DistanceCache
+from distance_providers import DistanceProvider, make_distance_providers
+from distance_resolver import DistanceResolver
+from http_engine import HttpEngine
+from async_http_engine import AsyncHttpEngine
+from metrics import Metrics
+from office_catalog import OfficeCatalog
+from office_ranker import OfficeRanker
+from cita_selector import CitaSelector
+from scheduler import AttemptScheduler
+from history import AvailabilityHistory
+from corpus import PageCorpus
+from network import NetworkMonitor, default_blocked_url_patterns
+from chrome_launcher import chrome_arguments, is_up
+from supervisor import Supervisor
+from wait import Waiter
+from page import PageKind, Page, Office, Cita, parse_page, page_from_json, extract_page_script, \
+    extract_page_script_args
 
 
 class AutoCita:
@@ -21,26 +39,57 @@ class AutoCita:
     phone: str
     exp: str
     address: str
-    office_distances: Dict[str, int]
+    travel_mode: str
+    distance_provider: DistanceProvider
+    fallback_distance_provider: Optional[DistanceProvider]  # straight line estimates until the routes are in
+    distance_cache: DistanceCache
+    distance_resolver: DistanceResolver  # every route lookup, off the booking path
+    office_catalog: OfficeCatalog
+    office_ranker: OfficeRanker
     desired_office_code: int
     tramite_code: int
-    max_cita_date: datetime
+    cita_selector: CitaSelector
 
     sleep_minutes: int
+    scheduler: Optional[AttemptScheduler]
+    saw_slots: bool  # whether the current attempt was offered offices or citas
+    history: Optional[AvailabilityHistory]
+    office_id: str  # chosen in the current attempt
+    corpus: Optional[PageCorpus]
+    step: str  # the one running
+    metrics: Metrics
     google_maps_api_key: str
+    extract_in_browser: bool
+    session_reset: str
     debug: bool
 
-    browser: webdriver.Chrome
-    tried_offices: Set[str] = set()
-
-    def __init__(self, app: App, info: Info):
+    base_url: str = base_url
+    transport: str
+    http: Optional[HttpEngine]
+    loop: Optional[asyncio.AbstractEventLoop]
+    block_requests: bool
+    blocked_url_patterns: List[str]
+    count_network: bool
+
+    chrome_profile_path: str
+    chrome_debugger_address: str
+    started_at: Optional[float]  # perf_counter() when the process started, None once the startup time is reported
+    wait_poll_interval: float
+    wait_with_observer: bool
+    browser: Optional[webdriver.Chrome]
+    network: NetworkMonitor
+    wait: Waiter
+    before_attempt: Optional[Callable[[], None]]  # e.g. Supervisor's browser checks
+
+    def __init__(self, app: App, info: Info, started_at: Optional[float] = None):
+        self.started_at = perf_counter() if started_at is None else started_at
         self.full_name = info.full_name.strip().upper()
         self.nie = info.nie.strip().upper()
         if not nie_pattern.match(self.nie):
             # TODO: validate check digit
             raise ValueError('N.I.E. format error')
         self.country_code = str(info.country_code)
-        if info.country_code not in countries.values():
+        if info.country_code not in country_codes:
             raise CountryNotFoundError
         self.email = info.email.strip().lower()
         self.phone = info.phone.strip()
@@ -52,117 +101,274 @@ class AutoCita:
         except ValueError:
             raise ValueError('Current card expiry date format error')
         self.address = info.address.strip()
-        self.office_distances = info.offices_distances
+        self.travel_mode = info.travel_mode
         if info.desired_office_code == -1 and info.tramite_code == 4036:
             raise ValueError('Must specify desired office for recogida de tarjeta')
-        if info.desired_office_code not in office_codes.values():
-            raise OfficeNotFoundError
         self.desired_office_code = info.desired_office_code
-        if info.tramite_code not in tramites.values():
+        if info.tramite_code not in tramite_codes:
             raise TramiteNotFoundError
         self.tramite_code = info.tramite_code
-        try:
-            self.max_cita_date = datetime.strptime(info.max_cita_date.strip(), '%d/%m/%Y')
-        except ValueError:
-            raise ValueError('Max cita date format error')
+        self.cita_selector = CitaSelector(info.min_cita_date, info.max_cita_date, info.cita_time_windows,
+                                          info.excluded_weekdays, info.cita_rank, info.preferred_cita_time)
+        # the rest of the config is checked too before anything is opened or started, nothing is left behind
+        if app.scheduler not in ('fixed', 'adaptive'):
+            raise ValueError(f'Unknown scheduler: {app.scheduler}')
+        if app.session_reset not in ('cdp', 'reload'):
+            raise ValueError(f'Unknown session reset: {app.session_reset}')
+        if app.transport not in ('browser', 'hybrid'):
+            raise ValueError(f'Unknown transport: {app.transport}')
+        if app.http_engine not in ('requests', 'asyncio'):
+            raise ValueError(f'Unknown HTTP engine: {app.http_engine}')
+        self.metrics = Metrics(app.metrics_path, app.metrics_format)
+        self.distance_provider, self.fallback_distance_provider = make_distance_providers(
+            app.distance_provider, app.google_maps_api_key, self.travel_mode, info.address_coordinates)
+
+        self.office_catalog = OfficeCatalog(app.office_catalog_path, office_codes)
+        if info.preferred_office_code != -1 and info.preferred_office_code not in self.office_catalog or \
+                info.desired_office_code != -1 and info.desired_office_code not in self.office_catalog:
+            self.office_catalog.close()
+            raise OfficeNotFoundError
+        self.distance_cache = DistanceCache(app.distance_cache_path, app.distance_cache_ttl_days * 24 * 3600)
+        if len(info.offices_distances) != 0:  # pre-calculated distances from the legacy JSON file
+            self.distance_cache.put_many(self.address, self.travel_mode, info.offices_distances, overwrite=False)
+        if self.distance_provider.cacheable:
+            routes = self.distance_cache.get_routes(self.address, self.distance_provider.mode)
+        else:
+            routes = self.distance_provider.get_routes(self.address, list(self.office_catalog.ids))
+        self.office_ranker = OfficeRanker(self.office_catalog.ids, routes, info.distance_weight,
+                                          info.duration_weight, info.preferred_office_code)
+        # from now on only the resolver's thread calls the distance provider
+        self.distance_resolver = DistanceResolver(
+            self.address, self.distance_provider,
+            DistanceCache(app.distance_cache_path, app.distance_cache_ttl_days * 24 * 3600))
+        # offices learned in earlier runs whose routes were never fetched
+        self.distance_resolver.submit(name for id, name in self.office_catalog.names.items()
+                                      if id in self.office_catalog.learned and name not in routes)
 
         self.sleep_minutes = app.sleep_minutes
+        self.scheduler = None
+        if app.scheduler == 'adaptive':
+            self.scheduler = AttemptScheduler(app.schedule_history_path, app.schedule_min_minutes * 60,
+                                              app.schedule_max_minutes * 60, app.schedule_attempts_per_hour)
+        self.saw_slots = False
+        self.history = AvailabilityHistory(app.history_path) if app.history_path else None
+        self.office_id = ''
+        # personal data never gets into the corpus
+        self.corpus = PageCorpus(app.corpus_path, (self.nie, self.full_name, self.email, self.phone, self.exp)) \
+            if app.corpus_path else None
+        self.step = ''
         self.google_maps_api_key = app.google_maps_api_key
+        self.extract_in_browser = app.extract_in_browser
+        self.session_reset = app.session_reset
         self.debug = app.debug
 
-        self.init_browser(app.chrome_profile_path)
+        self.block_requests = app.block_requests
+        self.blocked_url_patterns = app.blocked_url_patterns or default_blocked_url_patterns
+        self.count_network = app.count_network
+
+        self.transport = app.transport
+        self.http = None
+        self.loop = None
+        if self.transport == 'hybrid':
+            engine = AsyncHttpEngine if app.http_engine == 'asyncio' else HttpEngine
+            self.http = engine(self.base_url, self.nie, self.full_name, self.country_code, self.exp, self.email,
+                               self.phone, self.tramite_code, self.desired_office_code, self.choose_office_id,
+                               self.choose_offered_cita_id,
+                               capture=self.corpus.record if self.corpus is not None else None)
+            if app.http_engine == 'asyncio':
+                # kept for the whole run, so is the engine's connection pool
+                self.loop = asyncio.new_event_loop()
+
+        self.chrome_profile_path = app.chrome_profile_path
+        self.chrome_debugger_address = app.chrome_debugger_address
+        self.wait_poll_interval = app.wait_poll_interval
+        self.wait_with_observer = app.wait_with_observer
+        self.browser = None
+        self.before_attempt = None
+        if self.transport == 'browser' or not app.hybrid_lazy_browser:
+            try:
+                self.start_browser()
+            except Exception:
+                # e.g. no Chrome: the resolver's thread and the databases are already open
+                self.close()
+                raise
+
+    def start_browser(self):
+        self.init_browser(self.chrome_profile_path)
+        self.wait = Waiter(self.browser, 30, self.wait_poll_interval, self.wait_with_observer)
+
+    def quit_browser(self):
+        if self.browser is None:
+            return
+        try:
+            self.browser.quit()
+        except Exception:  # already gone
+            pass
+        self.browser = None
 
     def init_browser(self, chrome_profile_path: str):
         options = webdriver.ChromeOptions()
-        options.add_argument('--disable-extensions')
-        options.add_argument('--disable-plugins-discovery')
-        options.add_argument('--disable-notifications')
-        options.add_argument('--disable-translate')
-        options.add_argument('--disable-sync')
-        options.add_argument('--disable-infobars')
-        options.add_argument('--disable-gpu')
-        options.add_argument('--lang=en')
-        # options.add_argument('--no-sandbox')
-        options.add_argument('--window-size=1280,800')
-        options.add_argument('--no-first-run')
-        options.add_argument('--no-service-autorun')
-        options.add_argument('--password-store=basic')
-        options.add_argument('--disable-blink-features=AutomationControlled')
-        options.add_argument(f"--user-data-dir={chrome_profile_path}")
-        options.add_experimental_option('prefs', {'intl.accept_languages': 'en_US,es_ES,ca'})
-        options.add_experimental_option('excludeSwitches', ['enable-automation'])
-        options.add_experimental_option('useAutomationExtension', False)
-        if self.debug:
-            options.add_experimental_option('detach', True)
-            # options.add_argument('--proxy-server=http://127.0.0.1:10086')
+        if self.chrome_debugger_address:
+            # attach to the long-lived Chrome of chrome_launcher.py, it was started with the flags below;
+            # ChromeDriver rejects the launch options when attaching
+            if not is_up(self.chrome_debugger_address):
+                raise Exception(f'No Chrome on {self.chrome_debugger_address}, start it with chrome_launcher.py')
+            options.add_experimental_option('debuggerAddress', self.chrome_debugger_address)
         else:
-            options.add_argument('--headless')
+            for argument in chrome_arguments(chrome_profile_path, not self.debug, self.transport == 'hybrid'):
+                options.add_argument(argument)
+            options.add_experimental_option('prefs', {'intl.accept_languages': 'en_US,es_ES,ca'})
+            options.add_experimental_option('excludeSwitches', ['enable-automation'])
+            options.add_experimental_option('useAutomationExtension', False)
+            if self.debug:
+                options.add_experimental_option('detach', True)
+                # options.add_argument('--proxy-server=http://127.0.0.1:10086')
+        if self.count_network:
+            NetworkMonitor.enable_logging(options)
         self.browser = webdriver.Chrome(options=options)
+        self.network = NetworkMonitor(self.browser, self.blocked_url_patterns if self.block_requests else [])
+        if self.block_requests or self.count_network:
+            self.network.start()
 
     def work(self):
         while True:
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Start working")
+            if self.before_attempt is not None:
+                self.before_attempt()
+            self.start_attempt()
+            if self.transport == 'hybrid':
+                # look up over plain HTTP, the browser is only used from the offered citas on
+                steps = self.http.lookup_steps + (self.hand_over, self.acVerificarCita)
+            else:
+                steps = (self.citar, self.acInfo, self.acEntrada, self.acValidarEntrada, self.acCitar,
+                         self.acVerFormulario, self.acOfertarCita, self.acVerificarCita)
+            if self.started_at is not None:
+                startup_seconds = perf_counter() - self.started_at
+                self.started_at = None
+                self.metrics.started(startup_seconds)
+                print(f'[INFO] Started in {startup_seconds:.2f} s')
             try:
-                self.citar()
-                self.acInfo()
-                self.acEntrada()
-                self.acValidarEntrada()
-                self.acCitar()
-                self.acVerFormulario()
-                self.acOfertarCita()
-                self.acVerificarCita()
-                cita_code = self.acGrabarCita()
+                for step in steps:
+                    with self.metrics.step(step.__name__):
+                        self.run_step(step)
+                with self.metrics.step('acGrabarCita'):
+                    cita_code = self.run_step(self.acGrabarCita)
+                self.finish_attempt('succeeded')
                 print(f'[SUCCEEDED] Cita number: {cita_code}')
                 return True
             except FailedAttemptAtOffice as e:
+                self.finish_attempt(type(e).__name__)
                 print(f'[FAILED] {e}')
                 continue
             except FailedAttempt as e:
+                self.finish_attempt(type(e).__name__)
                 print(f'[FAILED] {e}')
-                sleep(self.sleep_minutes * 60)
+                delay = self.scheduler.next_delay() if self.scheduler is not None else self.sleep_minutes * 60
+                if self.debug:
+                    print(f'[INFO] Next attempt in {delay / 60:.1f} minutes')
+                sleep(delay)
+                self.metrics.slept(delay)
             except Exception as e:
+                self.finish_attempt(type(e).__name__)
                 raise e
             finally:
-                if self.debug and len(self.tried_offices) != 0:
-                    print(f'Tried offices: {list(self.tried_offices)}')
+                if self.debug and len(self.office_ranker.tried) != 0:
+                    print(f'Tried offices: {list(self.office_ranker.tried)}')
+
+    def run_step(self, step):
+        self.step = step.__name__
+        # every browser step's page goes into the corpus once, as the step starts on it; citar loads its own
+        # first, the HTTP engine's steps record their responses
+        if getattr(step, '__self__', None) is self and step not in (self.citar, self.hand_over):
+            self.record_page()
+        # the asyncio engine's steps are coroutines
+        result = step()
+        if asyncio.iscoroutine(result):
+            return self.loop.run_until_complete(result)
+        return result
+
+    def record_page(self):
+        if self.corpus is not None and self.browser is not None:
+            self.corpus.record(self.step, self.browser.page_source)
+
+    def close(self):
+        # the browser is left open, as it always was
+        if self.corpus is not None:
+            self.corpus.close()
+        if self.history is not None:
+            self.history.close()
+        if self.scheduler is not None:
+            self.scheduler.close()
+        self.distance_resolver.close()
+        self.distance_cache.close()
+        self.office_catalog.close()
+        if self.loop is not None:
+            self.loop.run_until_complete(self.http.close())
+            self.loop.close()
+            self.loop = None
+
+    def start_attempt(self):
+        self.saw_slots = False
+        self.office_id = ''
+
+    def finish_attempt(self, outcome: str):
+        if self.count_network and self.browser is not None:
+            try:
+                transferred, requests, blocked = self.network.collect()
+            except WebDriverException:
+                pass
+            else:
+                self.metrics.transferred(transferred, requests, blocked)
+                if self.debug:
+                    print(f'[INFO] Transferred {transferred / 1024:.1f} KB in {requests} requests ({blocked} blocked)')
+        self.metrics.attempt_finished(outcome)
+        if self.scheduler is not None:
+            self.scheduler.record(self.saw_slots, outcome == ServerError.__name__)
+        if self.history is not None:
+            self.history.flush()
+        if self.corpus is not None:
+            self.corpus.flush()
+        self.office_catalog.flush()
 
     def citar(self):
-        self.browser.get(f'{base_url}/icpplustieb/citar?p=8&locale=es')
-        self.browser.delete_all_cookies()
-        self.browser.refresh()
+        url = f'{self.base_url}/icpplustieb/citar?p=8&locale=es'
+        # both ways are timed under the same name, so their cost can be compared in the metrics
+        with self.metrics.step('session_reset'):
+            if self.session_reset == 'cdp':
+                # drop the server session before the only navigation, instead of loading the page twice;
+                # only the sede's data, the profile keeps the reCAPTCHA cookies of other domains
+                self.browser.execute_cdp_cmd('Storage.clearDataForOrigin', {
+                    'origin': self.base_url, 'storageTypes': 'cookies,local_storage,session_storage'})
+                self.browser.get(url)
+            else:
+                self.browser.get(url)
+                self.browser.delete_all_cookies()
+                self.browser.refresh()
+        self.record_page()
 
-        if error_503_message in self.browser.page_source:
-            raise FailedAttempt('Server 503 error')
+        if self.read_page(PageKind.ERROR_503, PageKind.OTHER).kind == PageKind.ERROR_503:
+            self.metrics.event('server_503')
+            raise ServerError('Server 503 error')
 
         # accept cookies to prevent banner from covering elements
-        WebDriverWait(self.browser, 30).until(
-            EC.element_to_be_clickable((By.ID, 'cookie_action_close_header'))
-        ).click()
+        self.wait.clickable('cookie_action_close_header').click()
 
         if self.desired_office_code != -1:
             # select desired office
-            WebDriverWait(self.browser, 30).until(
-                EC.presence_of_element_located((By.ID, 'sede'))
-            )
+            self.wait.element('sede')
             self.browser.execute_script(f"document.getElementById('sede').value={self.desired_office_code};"
                                         f"cargaTramites();")
 
         # select tramite
-        WebDriverWait(self.browser, 30).until(
-            EC.presence_of_element_located((By.ID, 'tramiteGrupo[0]'))
-        )
+        self.wait.element('tramiteGrupo[0]')
         self.browser.execute_script(f"document.getElementById('tramiteGrupo[0]').value={self.tramite_code};"
                                     f"document.portadaForm.submit();")
 
     def acInfo(self):
-        WebDriverWait(self.browser, 30).until(
-            EC.element_to_be_clickable((By.ID, 'btnEntrar'))
-        ).click()
+        self.wait.clickable('btnEntrar').click()
 
     def acEntrada(self):
-        WebDriverWait(self.browser, 30).until(
-            EC.presence_of_element_located((By.ID, 'txtIdCitado'))
-        )
+        self.wait.element('txtIdCitado')
         # fill-in the form and submit with JS, because had trouble filling a date into txtFecha (dropping "/")
         if self.tramite_code == 4010:  # toma de huellas
             self.browser.execute_script(f"document.getElementById('txtIdCitado').value='{self.nie}';"
@@ -178,40 +384,24 @@ class AutoCita:
             raise UnsupportedTramiteError
 
     def acValidarEntrada(self):
-        WebDriverWait(self.browser, 30).until(
-            EC.element_to_be_clickable((By.ID, 'btnEnviar'))
-        ).click()
+        self.wait.clickable('btnEnviar').click()
 
     def acCitar(self):
-        if no_cita_message in self.browser.page_source:
-            self.tried_offices.clear()
-            raise FailedAttempt('No available cita')
-
         if self.tramite_code == 4010:  # toma de huellas
-            nearest_office_id = self.get_nearest_office_id(self.browser.page_source)
-            if nearest_office_id == '':
-                self.tried_offices.clear()
-                raise FailedAttempt('No available cita')
-
-            self.tried_offices.add(nearest_office_id)
+            page = self.read_page(PageKind.NO_CITA, PageKind.OFFICES)
+        else:
+            page = self.read_page(PageKind.NO_CITA, PageKind.OTHER)
+        nearest_office_id = self.choose_office_id(page)
+        if nearest_office_id == '':  # recogida de tarjeta
+            return  # go to acVerFormulario
 
-            # select office
-            Select(WebDriverWait(self.browser, 30).until(
-                EC.presence_of_element_located((By.ID, 'idSede'))
-            )).select_by_value(nearest_office_id)
+        # select office
+        Select(self.wait.element('idSede')).select_by_value(nearest_office_id)
 
-            WebDriverWait(self.browser, 30).until(
-                EC.element_to_be_clickable((By.ID, 'btnSiguiente'))
-            ).click()
-        elif self.tramite_code == 4036:  # recogida de tarjeta
-            return  # go to acVerFormulario
-        else:
-            raise UnsupportedTramiteError
+        self.wait.clickable('btnSiguiente').click()
 
     def acVerFormulario(self):
-        WebDriverWait(self.browser, 30).until(
-            EC.presence_of_element_located((By.ID, 'txtTelefonoCitado'))
-        )
+        self.wait.element('txtTelefonoCitado')
         self.browser.execute_script(f"document.getElementById('txtTelefonoCitado').value='{self.phone}';"
                                     f"document.getElementById('emailUNO').value='{self.email}';"
                                     f"document.getElementById('emailDOS').value='{self.email}';"
@@ -219,139 +409,162 @@ class AutoCita:
                                     f"document.procedimientos.submit();")
 
     def acOfertarCita(self):
-        if no_cita_message in self.browser.page_source:
-            raise FailedAttemptAtOffice('No available cita in this office')
-
-        cita_id = self.choose_cita_id(self.browser.page_source)
-        if cita_id == '':
-            raise FailedAttemptAtOffice('No available cita in this office before max cita date')
-        WebDriverWait(self.browser, 30).until(
-            EC.element_to_be_clickable((By.ID, f'cita{cita_id}'))
-        ).click()
+        page = self.read_page(PageKind.NO_CITA, PageKind.CITAS)
+        self.select_cita(self.choose_offered_cita_id(page))
+
+    def hand_over(self):
+        # the browser takes over the session the HTTP engine opened, on the page offering the citas
+        if self.browser is None:
+            with self.metrics.step('browser_start'):
+                self.start_browser()
+        self.browser.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': self.base_url, 'storageTypes': 'cookies'})
+        for cookie in self.http.cookies():
+            self.browser.execute_cdp_cmd('Network.setCookie', cookie)
+        # any cheap same-origin document will do, the offered page is written into it
+        self.browser.get(f'{self.base_url}/robots.txt')
+        self.browser.execute_script('document.open(); document.write(arguments[0]); document.close();',
+                                    self.http.offered_html())
+        self.select_cita(self.http.cita_id)
+
+    def select_cita(self, cita_id: str):
+        self.wait.clickable(f'cita{cita_id}').click()
 
         try:
-            WebDriverWait(self.browser, 30).until(
+            self.wait.until(
                 lambda driver: driver.find_element(By.ID, 'g-recaptcha-response').get_attribute('value') != ''
             )
         except TimeoutException:
             raise Exception('Can\'t get reCAPTCHA response')
 
-        WebDriverWait(self.browser, 30).until(
-            EC.element_to_be_clickable((By.ID, 'btnSiguiente'))
-        ).click()
+        self.wait.clickable('btnSiguiente').click()
 
-        WebDriverWait(self.browser, 30).until(
-            EC.alert_is_present()
-        )
+        self.wait.until(EC.alert_is_present())
         self.browser.switch_to.alert.accept()
 
     def acVerificarCita(self):
-        if 'Captcha' in self.browser.page_source:
+        page = self.read_page(PageKind.CAPTCHA_FAILED, PageKind.SMS_VERIFICATION, PageKind.OTHER)
+        if page.kind == PageKind.CAPTCHA_FAILED:
             raise FailedAttempt('Failed to pass reCAPTCHA')
 
-        if 'txtCodigoVerificacion' in self.browser.page_source:  # SMS verification needed
-            sms_verification_code_txt = WebDriverWait(self.browser, 30).until(
-                EC.presence_of_element_located((By.ID, 'txtCodigoVerificacion'))
-            )
+        if page.kind == PageKind.SMS_VERIFICATION:  # SMS verification needed
+            sms_verification_code_txt = self.wait.element('txtCodigoVerificacion')
             sms_verification_code = input('SMS verification code: ').strip()
             if len(sms_verification_code) != 5 or not sms_verification_code.isnumeric():
                 raise ValueError('SMS verification code format error')
             sms_verification_code_txt.send_keys(sms_verification_code)
 
-        WebDriverWait(self.browser, 30).until(
-            EC.element_to_be_clickable((By.ID, 'chkTotal'))
-        ).click()
+        self.wait.clickable('chkTotal').click()
 
-        WebDriverWait(self.browser, 30).until(
-            EC.element_to_be_clickable((By.ID, 'enviarCorreo'))
-        ).click()
+        self.wait.clickable('enviarCorreo').click()
 
-        WebDriverWait(self.browser, 30).until(
-            EC.element_to_be_clickable((By.ID, 'btnConfirmar'))
-        ).click()
+        self.wait.clickable('btnConfirmar').click()
 
     def acGrabarCita(self) -> str:
-        return WebDriverWait(self.browser, 30).until(
-            EC.presence_of_element_located((By.ID, 'justificanteFinal'))
-        ).text
-
-    def get_nearest_office_id(self, html: str) -> str:
-        offices = offices_pattern.findall(html)
-        if len(offices) == 0:
-            if '<option' in html:
-                print(html)
+        return self.wait.element('justificanteFinal').text
+
+    def read_page(self, *expected_kinds: PageKind) -> Page:
+        # extract only the needed data inside the browser, fall back to parsing the whole page source
+        # when the DOM has an unexpected shape or the page is not one the current step expects
+        if self.extract_in_browser:
+            try:
+                page = page_from_json(self.browser.execute_script(extract_page_script, *extract_page_script_args))
+            except WebDriverException:
+                page = None
+            if page is not None and page.kind in expected_kinds:
+                return page
+            if self.debug:
+                print('[INFO] In-browser extraction fell back to page source')
+        return parse_page(self.browser.page_source)
+
+    def choose_office_id(self, page: Page) -> str:
+        # returns '' when the tramite has no office to choose
+        if page.kind == PageKind.NO_CITA:
+            self.office_ranker.reset()
+            raise FailedAttempt('No available cita')
+
+        if self.tramite_code == 4036:  # recogida de tarjeta
+            return ''
+        elif self.tramite_code != 4010:  # toma de huellas
+            raise UnsupportedTramiteError
+        self.saw_slots = True
+        if self.history is not None:
+            self.history.record_offices(page.offices)
+        if len(page.offices) == 0:
+            if '<option' in page.html:
+                print(page.html)
                 print('------[UNKNOWN ERROR]-----')
                 exit(0)
             raise Exception('Can\'t extract offices')
-        offices = dict([(v[1], v[0]) for v in offices])  # swap to name-id pairs
+        nearest_office_id = self.get_nearest_office_id(page.offices)
+        if nearest_office_id == '':
+            self.office_ranker.reset()
+            raise FailedAttempt('No available cita')
+
+        self.office_ranker.mark_tried(nearest_office_id)
+        self.office_id = nearest_office_id
+        return nearest_office_id
+
+    def choose_offered_cita_id(self, page: Page) -> str:
+        if page.kind == PageKind.NO_CITA:
+            raise FailedAttemptAtOffice('No available cita in this office')
+
+        self.saw_slots = True
+        if self.history is not None:
+            self.history.record_citas(int(self.office_id) if self.office_id else self.desired_office_code, page.citas)
+        if len(page.citas) == 0:
+            print(page.html)
+            raise Exception('Can\'t extract citas')
+        cita_id = self.choose_cita_id(page.citas)
+        if cita_id == '':
+            raise FailedAttemptAtOffice('No available cita in this office within the cita constraints')
+        return cita_id
+
+    def get_nearest_office_id(self, offered_offices: List[Office]) -> str:
+        new_offices = self.office_catalog.learn(offered_offices)
         if self.debug:
-            # dump new offices
-            with open(r'offices.log', 'a+') as f:
-                for name, id in offices.items():
-                    if int(id) not in office_codes.values():
-                        print(f'[INFO] Found new office: {name} (id={id})')
-                        f.write(f'{name} - {id}\n')
-        distances = {}
-        offices_to_check = []
-        for name, id in list(offices.items()):
-            if id in self.tried_offices:
-                offices.pop(name)
-            else:
-                try:
-                    distances[name] = self.office_distances[name]
-                except KeyError:
-                    offices_to_check.append(name)
-        if len(distances) == 0 and len(offices_to_check) == 0:
+            for office in new_offices:
+                print(f'[INFO] Found new office: {office.name} (id={office.id})')
+        routes = self.distance_resolver.collect()
+        if len(routes) != 0:
+            self.office_ranker.update(routes)
+        names = [o.name for o in self.office_ranker.learn(offered_offices)]
+        if len(names) != 0:
+            # never waited for here, the slot may be gone by the time the API answers: the routes are looked up
+            # in the background for the next attempts, this one ranks by straight line estimates or puts them last
+            self.distance_resolver.submit(names)
+            names = [name for name in names if name not in self.office_ranker.estimates]
+            if self.fallback_distance_provider is not None and len(names) != 0:
+                # an office without coordinates has no estimate either, it's not asked for again
+                self.office_ranker.estimate({name: None for name in names} |
+                                            self.fallback_distance_provider.get_routes(self.address, names))
+
+        nearest_office_id = self.office_ranker.best(o.id for o in offered_offices)
+        if nearest_office_id is None:
             return ''
-
-        if len(offices_to_check) != 0:
-            # get distances through Google Maps DistanceMatrix API
-            url = f'https://maps.googleapis.com/maps/api/distancematrix/json?key={self.google_maps_api_key}&language=en&region=es&origins={self.address}&destinations={"|".join(offices_to_check)}'
-            try:
-                resp = requests.get(url).json()
-            except Exception as e:
-                raise Exception(f'Google DistanceMatrix API error: {e}')
-            if resp['status'] != 'OK' or len(resp['rows']) == 0:
-                raise Exception(f'Google DistanceMatrix API error: {resp["status"]}')
-            for i, e in enumerate(resp['rows'][0]['elements']):
-                if e['status'] != 'OK':
-                    print(f'No route to office {offices_to_check[i]}')
-                else:
-                    distances[offices_to_check[i]] = e['distance']['value']
-
-        nearest_office = min(distances, key=distances.get)
         if self.debug:
-            print(f'[INFO] Nearest office: {nearest_office} (id={offices[nearest_office]})')
-        return offices[nearest_office]
+            print(f'[INFO] Nearest office: {self.office_ranker.names[nearest_office_id]} (id={nearest_office_id})')
+        return nearest_office_id
 
-    def choose_cita_id(self, html: str) -> str:
-        citas = cita_pattern.findall(html)
-        if len(citas) == 0:
-            print(html)
-            raise Exception('Can\'t extract citas')
-        for cita in citas:
-            cita_date = datetime.strptime(cita[1], '%d/%m/%Y')
-            if cita_date > self.max_cita_date:
-                continue
-            # TODO: implement time range option
-            return cita[0]
-        return ''
+    def choose_cita_id(self, citas: List[Cita]) -> str:
+        return self.cita_selector.best(citas)
 
 
-def main(app: App, info: Info):
+def main(app: App, info: Info, started_at: Optional[float] = None):
+    started_at = perf_counter() if started_at is None else started_at
     try:
         with open('office_distances.json', 'r') as f:
             office_distances = json.loads(f.read())
     except FileNotFoundError:
         office_distances = {}
-    if len(office_distances) == 0:
-        print('[ERROR] No pre-calculated office distances found')
-        return
-    else:
-        info.offices_distances = office_distances
+    info.offices_distances = office_distances
 
+    c = None
     try:
-        AutoCita(app, info).work()
+        c = AutoCita(app, info, started_at)
+        if app.supervise:
+            Supervisor(c, app).run()
+        else:
+            c.work()
     except ValueError as e:
         print(f'[ERROR] {e}')
     except CountryNotFoundError:
@@ -365,6 +578,9 @@ def main(app: App, info: Info):
             [f'{k}: {v}' for k, v in tramites.items()]))
     except Exception as e:
         print(f'[ERROR] {e}')
+    finally:
+        if c is not None:
+            c.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,166 @@
+import json
+import os
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Deque, Dict, List, Optional, Tuple
+
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(latency_buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(latency_buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    # per-step latencies, attempt outcomes and sleeping time of AutoCita.work(),
+    # exported to a local file as Prometheus text (node_exporter textfile format) or JSON lines
+    steps: Dict[str, Histogram]
+    outcomes: Dict[Tuple[str, str], int]  # (outcome, step) -> attempts
+    events: Dict[str, int]
+    attempt_times: Deque[float]
+
+    def __init__(self, path: str = '', format: str = 'prometheus'):
+        if format not in ('prometheus', 'jsonl'):
+            raise ValueError(f'Unknown metrics format: {format}')
+        self.path = path
+        self.format = format
+        self.started_at = time()
+        self.startup_seconds: Optional[float] = None
+        self.steps = {}
+        self.outcomes = {}
+        self.events = {}
+        self.attempt_times = deque()
+        self.sleep_seconds = 0.0
+        self.network_bytes = 0
+        self.network_requests = 0
+        self.network_blocked = 0
+        self.current_network: Optional[Tuple[int, int, int]] = None
+        self.current_steps: Dict[str, float] = {}
+        self.current_step: Optional[str] = None
+
+    @contextmanager
+    def step(self, name: str):
+        # steps can be nested, a failure is attributed to the innermost one
+        outer_step = self.current_step
+        self.current_step = name
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.steps.setdefault(name, Histogram()).observe(elapsed)
+            self.current_steps[name] = elapsed
+        self.current_step = outer_step
+
+    def started(self, seconds: float):
+        # from main() to the first citar
+        self.startup_seconds = seconds
+        if self.path:
+            if self.format == 'jsonl':
+                self.append({'ts': round(time(), 3), 'startup': round(seconds, 3)})
+            else:
+                self.write_prometheus()
+
+    def event(self, name: str):
+        self.events[name] = self.events.get(name, 0) + 1
+
+    def transferred(self, bytes: int, requests: int, blocked: int):
+        # what the browser transferred during the current attempt
+        self.network_bytes += bytes
+        self.network_requests += requests
+        self.network_blocked += blocked
+        self.current_network = (bytes, requests, blocked)
+
+    def slept(self, seconds: float):
+        self.sleep_seconds += seconds
+        if self.path:
+            if self.format == 'jsonl':
+                self.append({'ts': round(time(), 3), 'slept': round(seconds, 3)})
+            else:
+                self.write_prometheus()
+
+    def attempt_finished(self, outcome: str):
+        # outcome is 'succeeded' or the exception type name, the failing step is the last one started
+        now = time()
+        step = self.current_step if outcome != 'succeeded' else ''
+        self.outcomes[(outcome, step)] = self.outcomes.get((outcome, step), 0) + 1
+        self.attempt_times.append(now)
+        while self.attempt_times[0] < now - 3600:
+            self.attempt_times.popleft()
+        if self.path:
+            if self.format == 'jsonl':
+                record = {'ts': round(now, 3), 'outcome': outcome, 'step': step,
+                          'steps': {k: round(v, 4) for k, v in self.current_steps.items()}}
+                if self.current_network is not None:
+                    record['network'] = dict(zip(('bytes', 'requests', 'blocked'), self.current_network))
+                self.append(record)
+            else:
+                self.write_prometheus()
+        self.current_network = None
+        self.current_steps = {}
+        self.current_step = None
+
+    def append(self, record: dict):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def write_prometheus(self):
+        lines: List[str] = [
+            '# HELP autocita_step_duration_seconds Duration of each booking step.',
+            '# TYPE autocita_step_duration_seconds histogram',
+        ]
+        for name, h in self.steps.items():
+            cumulative = 0
+            for bound, count in zip(latency_buckets, h.counts):
+                cumulative += count
+                lines.append(f'autocita_step_duration_seconds_bucket{{step="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'autocita_step_duration_seconds_bucket{{step="{name}",le="+Inf"}} {h.count}')
+            lines.append(f'autocita_step_duration_seconds_sum{{step="{name}"}} {h.sum:.6f}')
+            lines.append(f'autocita_step_duration_seconds_count{{step="{name}"}} {h.count}')
+        lines += ['# HELP autocita_attempts_total Attempts by outcome and the step they ended at.',
+                  '# TYPE autocita_attempts_total counter']
+        for (outcome, step), count in self.outcomes.items():
+            lines.append(f'autocita_attempts_total{{outcome="{outcome}",step="{step}"}} {count}')
+        lines += ['# HELP autocita_events_total Notable server responses, e.g. 503 errors.',
+                  '# TYPE autocita_events_total counter']
+        for name, count in self.events.items():
+            lines.append(f'autocita_events_total{{event="{name}"}} {count}')
+        lines += ['# HELP autocita_attempts_last_hour Attempts finished within the last hour.',
+                  '# TYPE autocita_attempts_last_hour gauge',
+                  f'autocita_attempts_last_hour {len(self.attempt_times)}',
+                  '# HELP autocita_sleep_seconds_total Time spent sleeping between attempts.',
+                  '# TYPE autocita_sleep_seconds_total counter',
+                  f'autocita_sleep_seconds_total {self.sleep_seconds:.3f}',
+                  '# HELP autocita_network_bytes_total Bytes the browser transferred.',
+                  '# TYPE autocita_network_bytes_total counter',
+                  f'autocita_network_bytes_total {self.network_bytes}',
+                  '# HELP autocita_network_requests_total Requests the browser sent, and how many were blocked.',
+                  '# TYPE autocita_network_requests_total counter',
+                  f'autocita_network_requests_total{{blocked="false"}} {self.network_requests - self.network_blocked}',
+                  f'autocita_network_requests_total{{blocked="true"}} {self.network_blocked}',
+                  '# HELP autocita_start_time_seconds Unix time the process started.',
+                  '# TYPE autocita_start_time_seconds gauge',
+                  f'autocita_start_time_seconds {self.started_at:.3f}']
+        if self.startup_seconds is not None:
+            lines += ['# HELP autocita_startup_seconds Time from the process start to the first citar request.',
+                      '# TYPE autocita_startup_seconds gauge',
+                      f'autocita_startup_seconds {self.startup_seconds:.3f}']
+        # write to a temporary file and rename, so a scraper never reads a half written file
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,60 @@
+import json
+from fnmatch import fnmatch
+from typing import Dict, List, Optional, Tuple
+from selenium import webdriver
+
+# images, fonts, media and trackers; scripts and stylesheets are kept since the flow and reCAPTCHA need them
+default_blocked_url_patterns = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.webp',
+    '*.woff', '*.woff2', '*.ttf', '*.eot', '*.otf',
+    '*.mp4', '*.webm', '*.mp3',
+    '*google-analytics.com/*', '*googletagmanager.com/*', '*doubleclick.net/*',
+]
+# requests that must never be blocked, a warning is printed if a blocked pattern catches one
+default_required_url_patterns = [
+    '*/icpplustieb/*',
+    '*google.com/recaptcha/*',
+    '*gstatic.com/recaptcha/*',
+]
+
+
+class NetworkMonitor:
+    # blocks requests through CDP and counts what the browser transferred, from Chrome's performance log
+
+    def __init__(self, browser: webdriver.Chrome, blocked_url_patterns: Optional[List[str]] = None,
+                 required_url_patterns: Optional[List[str]] = None):
+        self.browser = browser
+        self.blocked_url_patterns = blocked_url_patterns or []
+        self.required_url_patterns = required_url_patterns or default_required_url_patterns
+        self.urls: Dict[str, str] = {}  # request id -> url, to report what got blocked
+
+    @staticmethod
+    def enable_logging(options: webdriver.ChromeOptions):
+        # must be set before the browser starts
+        options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+
+    def start(self):
+        self.browser.execute_cdp_cmd('Network.enable', {})
+        if len(self.blocked_url_patterns) != 0:
+            self.browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_url_patterns})
+
+    def collect(self) -> Tuple[int, int, int]:
+        # (bytes, requests, blocked requests) since the last call
+        transferred, requests, blocked = 0, 0, 0
+        for entry in self.browser.get_log('performance'):
+            message = json.loads(entry['message'])['message']
+            method, params = message['method'], message.get('params', {})
+            if method == 'Network.requestWillBeSent':
+                requests += 1
+                self.urls[params['requestId']] = params['request']['url']
+            elif method == 'Network.loadingFinished':
+                transferred += int(params.get('encodedDataLength', 0))
+                self.urls.pop(params['requestId'], None)
+            elif method == 'Network.loadingFailed':
+                url = self.urls.pop(params['requestId'], '')
+                if params.get('blockedReason'):
+                    blocked += 1
+                    if any(fnmatch(url, p) for p in self.required_url_patterns):
+                        print(f'[WARNING] Blocked a required request: {url}')
+        return transferred, requests, blocked
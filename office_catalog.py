@@ -0,0 +1,81 @@
+import argparse
+import sqlite3
+from datetime import datetime
+from time import time
+from typing import Dict, Iterable, List
+from constants import office_codes
+from page import Office
+
+
+class OfficeCatalog:
+    # every office the site is known to offer: constants.office_codes is only the seed, offices found in the
+    # idSede options are learned and persisted in SQLite, so the next run knows them too; both directions
+    # are dictionary lookups, nothing scans the whole catalog
+    names: Dict[str, str]  # office id -> name
+    ids: Dict[str, str]  # office name -> id
+    learned: Dict[str, float]  # office id -> when it was learned, for the offices not in the seed
+    pending: Dict[str, float]  # learned and not written yet, office id -> when
+
+    def __init__(self, path: str, seed: Dict[str, int]):
+        self.names = {str(id): name for name, id in seed.items()}
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS offices ('
+                              'id INTEGER PRIMARY KEY, name TEXT NOT NULL, learned_at REAL NOT NULL)')
+        self.learned = {}
+        for id, name, learned_at in self.conn.execute('SELECT id, name, learned_at FROM offices'):
+            self.names[str(id)] = name  # the site's latest name wins over the seed's
+            self.learned[str(id)] = learned_at
+        self.ids = {name: id for id, name in self.names.items()}
+        self.pending = {}
+
+    def __contains__(self, office_id) -> bool:
+        return str(office_id) in self.names
+
+    def learn(self, offices: Iterable[Office]) -> List[Office]:
+        # returns the offered offices that are new or renamed, known at once but only written by flush(),
+        # after the attempt, so the slot they're offered in isn't waited for on the disk
+        changed = [o for o in offices if self.names.get(o.id) != o.name]
+        if len(changed) == 0:
+            return changed
+        now = time()
+        for office in changed:
+            old_name = self.names.get(office.id)
+            if old_name is not None and self.ids.get(old_name) == office.id:
+                del self.ids[old_name]
+            self.names[office.id] = office.name
+            self.ids[office.name] = office.id
+            self.learned[office.id] = now
+            self.pending[office.id] = now
+        return changed
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO offices (id, name, learned_at) VALUES (?, ?, ?)',
+                                  [(int(id), self.names[id], learned_at) for id, learned_at in self.pending.items()])
+        self.pending = {}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List the offices learned from the site, '
+                                                 'in the format of constants.office_codes')
+    parser.add_argument('--path', default='offices.db')
+    args = parser.parse_args()
+
+    catalog = OfficeCatalog(args.path, office_codes)
+    for id, learned_at in sorted(catalog.learned.items(), key=lambda i: i[1]):
+        when = datetime.fromtimestamp(learned_at).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"    '{catalog.names[id]}': {id},  # learned {when}")
+    print(f'{len(catalog.learned)} learned, {len(catalog.names)} offices in total')
+    catalog.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+from typing import Dict, Iterable, List, Optional, Set
+from distance_cache import Route
+from page import Office
+
+detour_factor = 1.3  # roads are about this much longer than a straight line
+
+
+class OfficeRanker:
+    # keeps every known office in priority order, so picking an office is a lookup per offered id
+    names: Dict[str, str]  # office id -> name
+    routes: Dict[str, Optional[Route]]  # office name -> route, None when there is no route
+    estimates: Dict[str, Optional[Route]]  # office name -> rough route until the real one is known
+    rank: Dict[str, int]  # office id -> priority, lower is better
+    tried: Set[str]
+
+    def __init__(self, office_codes: Dict[str, int], routes: Dict[str, Optional[Route]],
+                 distance_weight: float = 1.0, duration_weight: float = 0.0, preferred_office_code: int = -1):
+        self.names = {str(id): name for name, id in office_codes.items()}
+        self.routes = dict(routes)
+        self.estimates = {}
+        self.distance_weight = distance_weight
+        self.duration_weight = duration_weight
+        self.preferred_office_id = str(preferred_office_code)
+        self.tried = set()
+        self.rank = {}
+        self.rebuild()
+
+    def cost(self, route: Route) -> float:
+        distance, duration = route
+        return self.distance_weight * distance + self.duration_weight * (duration or 0)
+
+    def rebuild(self):
+        # offices known to have no route are left out, an estimate stands in for a route that isn't known yet
+        # and the offices with neither come last
+        routes = self.estimates | self.routes
+        ranked = [id for id, name in self.names.items()
+                  if id == self.preferred_office_id or name not in self.routes or self.routes[name] is not None]
+        # the preferred office always comes first, then the cheapest
+        ranked.sort(key=lambda id: (id != self.preferred_office_id, routes.get(self.names[id]) is None,
+                                    self.cost(routes.get(self.names[id]) or (0, 0))))
+        self.rank = {id: i for i, id in enumerate(ranked)}
+
+    def learn(self, offices: Iterable[Office]) -> List[Office]:
+        # registers offices we haven't seen before, returns the ones without a known route yet
+        unknown = []
+        learned = False
+        for office in offices:
+            if office.id not in self.names:
+                self.names[office.id] = office.name
+                learned = True
+            if office.name not in self.routes and office.id not in self.tried:
+                unknown.append(office)
+        if learned:
+            self.rebuild()
+        return unknown
+
+    def update(self, routes: Dict[str, Optional[Route]]):
+        self.routes |= routes
+        for name in routes:
+            self.estimates.pop(name, None)
+        self.rebuild()
+
+    def estimate(self, routes: Dict[str, Optional[Route]]):
+        # straight line routes, e.g. from the haversine provider, stretched to compare with real ones
+        for name, route in routes.items():
+            if name in self.routes:
+                continue
+            if route is not None:
+                distance, duration = route
+                route = (round(distance * detour_factor), None if duration is None else round(duration * detour_factor))
+            self.estimates[name] = route
+        self.rebuild()
+
+    def best(self, office_ids: Iterable[str]) -> Optional[str]:
+        best_id, best_rank = None, None
+        for id in office_ids:
+            rank = self.rank.get(id)
+            if rank is None or id in self.tried:
+                continue
+            if best_rank is None or rank < best_rank:
+                best_id, best_rank = id, rank
+        return best_id
+
+    def mark_tried(self, office_id: str):
+        self.tried.add(office_id)
+
+    def reset(self):
+        self.tried.clear()
@@ -1,9 +1,11 @@
 import requests
-import configparser
 from typing import Set, Dict, Tuple, Union
 from time import sleep
 from datetime import datetime
 from constants import *
+from config import App, Info
+from distance_providers import DistanceProvider, make_distance_providers
+from page import extract_hidden_params
 
 
 class AutoCita:
@@ -18,20 +20,21 @@ class AutoCita:
     tramite: str
     max_cita_date: datetime
 
-    google_maps_api_key: str
+    distance_provider: DistanceProvider
     debug: bool
 
+    base_url: str = base_url
     r: requests.Session
     session_params: Dict[str, Union[str, Tuple[None, str]]]  # hidden UUIDs
     tried_offices: Set[str] = set()
 
-    def __init__(self, info: InfoConfig, google_maps_api_key: str, debug: bool):
+    def __init__(self, info: Info, distance_provider: DistanceProvider, debug: bool):
         self.full_name = info.full_name.strip().upper()
         self.nie = info.nie.strip().upper()
         if not nie_pattern.match(self.nie):
             # TODO: validate check digit
             raise ValueError('N.I.E. format error')
-        self.country = info.country_code.strip()
+        self.country = str(info.country_code)
         if not self.country.isnumeric() or int(self.country) not in countries.values():
             raise CountryNotFoundError
         self.email = info.email.strip()
@@ -44,7 +47,7 @@ class AutoCita:
         except ValueError:
             raise ValueError('Current card expiry date format error')
         self.address = info.address.strip()
-        self.tramite = info.tramite_code.strip()
+        self.tramite = str(info.tramite_code)
         if not self.tramite.isnumeric() or int(self.tramite) not in tramites.values():
             raise TramiteNotFoundError
         try:
@@ -52,7 +55,7 @@ class AutoCita:
         except ValueError:
             raise ValueError('Max cita date format error')
 
-        self.google_maps_api_key = google_maps_api_key
+        self.distance_provider = distance_provider
         self.debug = debug
 
     def work(self) -> bool:
@@ -88,28 +91,28 @@ class AutoCita:
             self.r.verify = r'FiddlerRoot.pem'
 
     def citar(self):
-        url = f'{base_url}/icpplustieb/citar?p=8&locale=es'
+        url = f'{self.base_url}/icpplustieb/citar?p=8&locale=es'
         resp = self.r.get(url)
         if error_503_message in resp.text:
             raise FailedAttempt('Server 503 error')
         self.update_session_params(resp.text)
-        self.r.headers.update({'Referer': url, 'Origin': base_url, 'Cache-Control': 'max-age=0'})
+        self.r.headers.update({'Referer': url, 'Origin': self.base_url, 'Cache-Control': 'max-age=0'})
 
     def acInfo(self):
-        url = f'{base_url}/icpplustieb/acInfo'
+        url = f'{self.base_url}/icpplustieb/acInfo'
         resp = self.r.post(url, data=self.session_params | {'sede': '99',  # TODO: implement specify office
                                                             'tramiteGrupo[0]': self.tramite})
         self.update_session_params(resp.text)
         self.r.headers.update({'Referer': url})
 
     def acEntrada(self):
-        url = f'{base_url}/icpplustieb/acEntrada'
+        url = f'{self.base_url}/icpplustieb/acEntrada'
         resp = self.r.post(url, data=self.session_params)
         self.update_session_params(resp.text)
         self.r.headers.update({'Referer': url})
 
     def acValidarEntrada(self):
-        url = f'{base_url}/icpplustieb/acValidarEntrada'
+        url = f'{self.base_url}/icpplustieb/acValidarEntrada'
         for k, v in self.session_params.items():  # convert to multipart/form-data
             self.session_params[k] = (None, v)
         resp = self.r.post(url, files=self.session_params | {'rdbTipoDoc': (None, 'N.I.E.'),
@@ -121,7 +124,7 @@ class AutoCita:
         self.r.headers.update({'Referer': url})
 
     def acCitar(self) -> str:
-        url = f'{base_url}/icpplustieb/acCitar'
+        url = f'{self.base_url}/icpplustieb/acCitar'
         resp = self.r.post(url, data=self.session_params)
         if no_cita_message in resp.text:
             self.tried_offices.clear()
@@ -137,7 +140,7 @@ class AutoCita:
         return nearest_office_id
 
     def acVerFormulario(self, nearest_office_id: str):
-        url = f'{base_url}/icpplustieb/acVerFormulario'
+        url = f'{self.base_url}/icpplustieb/acVerFormulario'
         resp = self.r.post(url, data=self.session_params | {'idSede': nearest_office_id})
         if self.debug:
             print(f'Tried offices: {list(self.tried_offices)}')
@@ -146,7 +149,7 @@ class AutoCita:
         self.r.headers.update({'Referer': url})
 
     def acOfertarCita(self) -> str:
-        url = f'{base_url}/icpplustieb/acOfertarCita'
+        url = f'{self.base_url}/icpplustieb/acOfertarCita'
         resp = self.r.post(url, data=self.session_params | {'txtMailCitado': self.email,
                                                             'emailDOS': self.email,
                                                             'txtTelefonoCitado': self.phone})
@@ -162,7 +165,7 @@ class AutoCita:
         return cita_id
 
     def acVerificarCita(self, cita_id: str):
-        url = f'{base_url}/icpplustieb/acVerificarCita'
+        url = f'{self.base_url}/icpplustieb/acVerificarCita'
         resp = self.r.post(url, data=self.session_params | {'rdbCita': cita_id})
         if 'Captcha' in resp.text:
             raise FailedAttempt('Failed to pass reCAPTCHA')
@@ -170,7 +173,7 @@ class AutoCita:
         self.r.headers.update({'Referer': url})
 
     def acVerificarCita_w_reCAPTCHA(self, cita_id: str, reCAPTCHA_site_key: str, reCAPTCHA_response: str):
-        url = f'{base_url}/icpplustieb/acVerificarCita'
+        url = f'{self.base_url}/icpplustieb/acVerificarCita'
         resp = self.r.post(url, data=self.session_params | {'rdbCita': cita_id,
                                                             'reCAPTCHA_site_key': reCAPTCHA_site_key,
                                                             'action': 'acOfertarCita',
@@ -181,7 +184,7 @@ class AutoCita:
         self.r.headers.update({'Referer': url})
 
     def acGrabarCita(self, sms_verification_code: str) -> str:
-        url = f'{base_url}/icpplustieb/acGrabarCita'
+        url = f'{self.base_url}/icpplustieb/acGrabarCita'
         if len(sms_verification_code) != 5 or not sms_verification_code.isnumeric():
             raise ValueError('SMS verification code format error')
         resp = self.r.post(url, data=self.session_params | {'txtCodigoVerificacion': sms_verification_code,
@@ -193,12 +196,11 @@ class AutoCita:
         return cita_code
 
     def update_session_params(self, html: str):
-        try:
-            hidden_params = hidden_params_pattern.findall(html)[0]
-        except IndexError:
+        hidden_params = extract_hidden_params(html)
+        if hidden_params is None:
             print(html)
             raise Exception('Can\'t extract hidden parameters')
-        self.session_params = {hidden_params[0]: hidden_params[1], hidden_params[2]: hidden_params[3]}
+        self.session_params = hidden_params
 
     def get_nearest_office_id(self, html: str) -> str:
         offices = offices_pattern.findall(html)
@@ -222,19 +224,11 @@ class AutoCita:
         if len(office_names) == 0:
             return ''
 
-        # get distances through Google Maps DistanceMatrix API
-        url = f'https://maps.googleapis.com/maps/api/distancematrix/json?key={self.google_maps_api_key}&language=en&region=es&origins={self.address}&destinations={"|".join(office_names)}'
-        try:
-            resp = requests.get(url).json()
-        except Exception as e:
-            raise Exception(f'Google DistanceMatrix API error: {e}')
-        if resp['status'] != 'OK' or len(resp['rows']) == 0:
-            raise Exception(f'Google DistanceMatrix API error: {resp["status"]}')
-        for i, e in enumerate(resp['rows'][0]['elements']):
-            if e['status'] != 'OK':
-                print(f'No route to office {office_names[i]}')
-            else:
-                distances[office_names[i]] = e['distance']['value']
+        for name, distance in self.distance_provider.get_distances(self.address, office_names).items():
+            if distance is not None:
+                distances[name] = distance
+        if len(distances) == 0:
+            return ''
 
         nearest_office = min(distances, key=distances.get)
         if self.debug:
@@ -255,13 +249,15 @@ class AutoCita:
         return ''
 
 
-def main(info: InfoConfig, sleep_minutes: int, google_maps_api_key: str, debug: bool):
+def main(app: App, info: Info):
     try:
-        c = AutoCita(info, google_maps_api_key, debug)
+        distance_provider, _ = make_distance_providers(app.distance_provider, app.google_maps_api_key,
+                                                       info.travel_mode, info.address_coordinates)
+        c = AutoCita(info, distance_provider, app.debug)
         while True:
             if c.work():
                 return
-            sleep(sleep_minutes * 60)
+            sleep(app.sleep_minutes * 60)
     except ValueError as e:
         print(f'[ERROR] {e}')
     except CountryNotFoundError:
@@ -275,22 +271,4 @@ def main(info: InfoConfig, sleep_minutes: int, google_maps_api_key: str, debug:
 
 
 if __name__ == '__main__':
-    config = configparser.ConfigParser()
-    config.read(r'config.ini')
-    debug = True if config['APP']['Debug'].lower() == 'true' else False
-    info = InfoConfig(
-        full_name=config['INFO']['FullName'],
-        nie=config['INFO']['NIE'],
-        country=config['INFO']['CountryCode'],
-        email=config['INFO']['Email'],
-        phone=config['INFO']['Phone'],
-        current_expiry_date=config['INFO']['CurrentExpiryDate'],
-        address=config['INFO']['Address'],
-        tramite=config['INFO']['TramiteCode'],
-        max_cita_date=config['INFO']['MaxCitaDate']
-    )
-
-    main(info=info,
-         sleep_minutes=int(config['APP']['SleepMinutes']),
-         google_maps_api_key=config['APP']['GoogleMapsAPIKey'],
-         debug=debug)
+    main(App(), Info())
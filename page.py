@@ -0,0 +1,253 @@
+from enum import Enum
+from typing import Dict, Iterator, List, Optional, Tuple
+from constants import error_503_message, no_cita_message, captcha_failed_marker, page_markers, \
+    offices_pattern, offices_end_marker, form_end_marker, cita_pattern, cita_code_pattern, uuid_pattern, \
+    uuid_attr_pattern, html_attr_pattern
+
+
+class PageKind(Enum):
+    ERROR_503 = 'error_503'
+    NO_CITA = 'no_cita'
+    CAPTCHA_FAILED = 'captcha_failed'
+    SMS_VERIFICATION = 'sms_verification'
+    OFFICES = 'offices'
+    CITAS = 'citas'
+    CONFIRMATION = 'confirmation'
+    OTHER = 'other'
+
+
+# when several markers are present the first one in this order wins
+_precedence = (PageKind.ERROR_503, PageKind.NO_CITA, PageKind.CAPTCHA_FAILED, PageKind.SMS_VERIFICATION,
+               PageKind.OFFICES, PageKind.CITAS, PageKind.CONFIRMATION)
+
+
+class Office:
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id: str, name: str):
+        self.id = id
+        self.name = name
+
+    def __repr__(self):
+        return f'Office({self.id!r}, {self.name!r})'
+
+
+class Cita:
+    __slots__ = ('id', 'date', 'time')
+
+    def __init__(self, id: str, date: str, time: str):
+        self.id = id
+        self.date = date  # dd/mm/yyyy
+        self.time = time  # HH:MM
+
+    def __repr__(self):
+        return f'Cita({self.id!r}, {self.date!r}, {self.time!r})'
+
+
+class Page:
+    __slots__ = ('kind', 'html', 'offices', 'citas', 'cita_code')
+
+    kind: PageKind
+    html: str
+    offices: List[Office]
+    citas: List[Cita]
+    cita_code: Optional[str]
+
+    def __init__(self, kind: PageKind, html: str, offices: List[Office], citas: List[Cita],
+                 cita_code: Optional[str]):
+        self.kind = kind
+        self.html = html
+        self.offices = offices
+        self.citas = citas
+        self.cita_code = cita_code
+
+    def __repr__(self):
+        return f'Page({self.kind.name}, offices={len(self.offices)}, citas={len(self.citas)})'
+
+
+def find_markers(html: str, positions: dict, start: int = 0):
+    # adds the first position from start of every marker not in positions yet
+    for name, marker in page_markers:
+        if name not in positions:
+            i = html.find(marker, start)
+            if i != -1:
+                positions[name] = i
+
+
+def parse_page(html: str) -> Page:
+    positions = {}
+    find_markers(html, positions)
+    return build_page(html, positions)
+
+
+def build_page(html: str, positions: dict) -> Page:
+    # positions: marker name -> first position in html
+    kind = PageKind.OTHER
+    for k in _precedence:
+        if k.value in positions:
+            kind = k
+            break
+
+    # the office and cita patterns only run over the region their marker points at
+    offices = []
+    if kind == PageKind.OFFICES:
+        start = positions['offices']
+        end = html.find(offices_end_marker, start)
+        if end == -1:
+            end = len(html)
+        offices = [Office(id, name) for id, name in offices_pattern.findall(html, start, end)]
+    citas = []
+    if kind == PageKind.CITAS:
+        citas = [Cita(*v) for v in cita_pattern.findall(html, positions['citas'])]
+    cita_code = None
+    if kind == PageKind.CONFIRMATION:
+        m = cita_code_pattern.search(html, positions['confirmation'])
+        if m is not None:
+            cita_code = m.group(1)
+
+    return Page(kind, html, offices, citas, cita_code)
+
+
+# longer input tags are skipped, so a tag with a missing '>' or quote can't make the scan quadratic
+_input_tag_limit = 1024
+
+
+def hidden_inputs(html: str, start: int = 0) -> Iterator[Tuple[str, str, int]]:
+    # (name, value, end) of every <input type="hidden"> named by a UUID, in one forward scan that only
+    # looks at the tags around a UUID name; stops at a tag that isn't complete yet, more of the page may
+    # still be streaming in
+    pos = start
+    while True:
+        m = uuid_attr_pattern.search(html, pos)
+        if m is None:
+            return
+        i = html.rfind('<', max(start, m.start() - _input_tag_limit), m.start())
+        end = html.find('>', m.end(), i + _input_tag_limit if i != -1 else m.end())
+        if end == -1 and i != -1 and len(html) - i < _input_tag_limit:
+            return
+        pos = m.end()
+        if i == -1 or end == -1 or html[i:i + 6].lower() != '<input':
+            continue
+        attrs = {}
+        for a in html_attr_pattern.finditer(html, i + 6, end):
+            name = a.group(1).lower()
+            if name not in attrs:
+                attrs[name] = a.group(2) or a.group(3) or a.group(4) or ''
+        if attrs.get('type', '').lower() == 'hidden' and uuid_pattern.fullmatch(attrs.get('name', '')):
+            yield attrs['name'], attrs.get('value', ''), end + 1
+        pos = end + 1
+
+
+def extract_hidden_params(html: str) -> Optional[Dict[str, str]]:
+    # the two hidden UUID inputs every step posts back, in any attribute order and with or without a value,
+    # in one forward scan that stops once both are found
+    params = {}
+    for name, value, _ in hidden_inputs(html):
+        params[name] = value
+        if len(params) == 2:
+            return params
+    return None
+
+
+# a chunk boundary can split a marker, rescan this much of what came before
+_scan_overlap = 64
+
+
+class PageScanner:
+    # scans a page while it streams in and tells when the rest of it isn't needed: as soon as a 503 or
+    # no cita marker shows up, or once the hidden parameters and the end of their form (and, if expected, the
+    # whole office list) arrived, a 503 or no cita message can still come after the parameters; pages of any
+    # other expected kind are read to the end
+    __slots__ = ('expected', 'html', 'positions', 'params', 'params_end')
+
+    def __init__(self, expected: PageKind = PageKind.OTHER):
+        self.expected = expected
+        self.html = ''
+        self.positions = {}
+        self.params = {}
+        self.params_end = 0  # where to look for the next hidden input
+
+    def feed(self, text: str) -> bool:
+        # returns True when the page has everything the step needs
+        start = max(0, len(self.html) - _scan_overlap)
+        params_start = max(self.params_end, len(self.html) - _input_tag_limit)
+        self.html += text
+        find_markers(self.html, self.positions, start)
+        if len(self.params) != 2:
+            for name, value, end in hidden_inputs(self.html, params_start):
+                self.params[name] = value
+                self.params_end = end
+                if len(self.params) == 2:
+                    break
+
+        if 'error_503' in self.positions or 'no_cita' in self.positions:
+            return True
+        if len(self.params) != 2:
+            return False
+        if self.expected == PageKind.OFFICES:
+            return 'offices' in self.positions and self.html.find(offices_end_marker, self.positions['offices']) != -1
+        return self.expected == PageKind.OTHER and \
+            self.html.find(form_end_marker, max(self.params_end, start)) != -1
+
+    def page(self) -> Page:
+        return build_page(self.html, self.positions)
+
+
+# runs inside the page and returns only the data the flow needs, instead of the serialized DOM;
+# returns null when the DOM doesn't have the shape we expect
+extract_page_script = r"""
+var text = document.body ? document.body.textContent : '';
+var r = {markers: [], offices: [], citas: [], code: null};
+if (text.indexOf(arguments[0]) !== -1) r.markers.push('error_503');
+if (text.indexOf(arguments[1]) !== -1) r.markers.push('no_cita');
+if (text.indexOf(arguments[2]) !== -1) r.markers.push('captcha_failed');
+if (document.getElementById('txtCodigoVerificacion')) r.markers.push('sms_verification');
+var sede = document.getElementById('idSede');
+if (sede) {
+    r.markers.push('offices');
+    for (var i = 0; i < sede.options.length; i++) {
+        var o = sede.options[i];
+        if (/^\d+$/.test(o.value)) r.offices.push([o.value, o.textContent.trim()]);
+    }
+}
+var radios = document.querySelectorAll('input[name="rdbCita"]');
+if (radios.length) r.markers.push('citas');
+for (var i = 0; i < radios.length; i++) {
+    var label = document.querySelector('label[for="' + radios[i].id + '"]');
+    var m = label && /(\d{2}\/\d{2}\/\d{4})[\s\S]*?(\d{2}:\d{2})/.exec(label.textContent);
+    if (!m || radios[i].id.indexOf('cita') !== 0) return null;
+    r.citas.push([radios[i].id.substring(4), m[1], m[2]]);
+}
+var code = document.getElementById('justificanteFinal');
+if (code) {
+    r.markers.push('confirmation');
+    r.code = code.textContent.trim();
+}
+return r;
+"""
+extract_page_script_args = (error_503_message, no_cita_message, captcha_failed_marker)
+
+
+def page_from_json(data) -> Optional[Page]:
+    # builds a Page from the result of extract_page_script, pages built this way have no html
+    if not isinstance(data, dict):
+        return None
+    try:
+        markers = set(data['markers'])
+        offices = [Office(str(id), str(name)) for id, name in data['offices']]
+        citas = [Cita(str(id), str(date), str(time)) for id, date, time in data['citas']]
+        cita_code = data['code']
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    kind = PageKind.OTHER
+    for k in _precedence:
+        if k.value in markers:
+            kind = k
+            break
+    if (kind == PageKind.OFFICES and len(offices) == 0) or (kind == PageKind.CITAS and len(citas) == 0) or \
+            (kind == PageKind.CONFIRMATION and not cita_code):
+        return None
+
+    return Page(kind, '', offices if kind == PageKind.OFFICES else [], citas if kind == PageKind.CITAS else [],
+                cita_code if kind == PageKind.CONFIRMATION else None)
@@ -1,40 +1,78 @@
-import json
+import argparse
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from typing import List
 from constants import office_codes
+from office_catalog import OfficeCatalog
+from distance_cache import DistanceCache
+from distance_providers import GoogleDistanceProvider
 from config import *
 
 
-def get_distances(google_maps_api_key: str, address: str, office_names: List[str]):
-    distances = {}
-    url = f'https://maps.googleapis.com/maps/api/distancematrix/json?key={google_maps_api_key}&language=en&region=es&origins={address}&destinations={"|".join(office_names)}'
-    try:
-        resp = requests.get(url).json()
-    except Exception as e:
-        raise Exception(f'Google DistanceMatrix API error: {e}')
-    if resp['status'] != 'OK' or len(resp['rows']) == 0:
-        raise Exception(f'Google DistanceMatrix API error: {resp["status"]}')
-    for i, e in enumerate(resp['rows'][0]['elements']):
-        if e['status'] != 'OK':
-            raise Exception(f'No route to office {office_names[i]}')
-        else:
-            distances[office_names[i]] = e['distance']['value']
-    return distances
-
-
 def divide_offices(l, n: int = 25):
     for i in range(0, len(l), n):
         yield l[i:i + n]
 
 
-google_maps_api_key = App().google_maps_api_key
-address = Info().address
-distances = {}
-try:
-    for offices in divide_offices(list(office_codes.keys())):
-        distances |= get_distances(google_maps_api_key, address, offices)
-except Exception as e:
-    print(f'[ERROR] {e}')
+def precalculate(cache: DistanceCache, providers: List[GoogleDistanceProvider], origins: List[str],
+                 offices: List[str], workers: int) -> int:
+    # the cache is the checkpoint: only what it doesn't have yet is fetched, and every batch is written
+    # back as soon as it arrives, so an interrupted run resumes where it stopped
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for provider in providers:
+            for origin in origins:
+                missing = cache.missing(origin, provider.mode, offices)
+                for batch in divide_offices(missing, provider.batch_size):
+                    futures[executor.submit(provider.get_routes_batch, origin, batch)] = (provider, origin)
+        for future in as_completed(futures):
+            provider, origin = futures[future]
+            try:
+                routes = future.result()
+            except Exception as e:
+                print(f'[ERROR] {origin} ({provider.mode}): {e}')
+                failed += 1
+                continue
+            cache.put_routes(origin, provider.mode, routes)  # written from this thread only
+    return failed
+
+
+def main():
+    app = App()
+    info = Info()
+    parser = argparse.ArgumentParser(description='Pre-calculate distances to every office into the distance cache')
+    parser.add_argument('--origin', action='append', help='origin address, can be repeated (default: Info.address)')
+    parser.add_argument('--mode', action='append', help='travel mode, can be repeated (default: Info.travel_mode)')
+    parser.add_argument('--workers', type=int, default=4, help='max concurrent batches')
+    parser.add_argument('--batch-size', type=int, default=25, help='destinations per request')
+    parser.add_argument('--retries', type=int, default=3, help='retries per batch on transient errors')
+    parser.add_argument('--api-url', help='Distance Matrix endpoint, e.g. a local stand-in server')
+    parser.add_argument('--cache', default=app.distance_cache_path, help='distance cache path')
+    parser.add_argument('--catalog', default=app.office_catalog_path, help='office catalog path, for the learned ones')
+    args = parser.parse_args()
+
+    origins = [o.strip() for o in (args.origin or [info.address])]
+    modes = args.mode or [info.travel_mode]
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=args.workers))
+    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=args.workers))
+    providers = [GoogleDistanceProvider(app.google_maps_api_key, mode, args.batch_size, session, args.api_url,
+                                        args.retries) for mode in modes]
+    catalog = OfficeCatalog(args.catalog, office_codes)
+    offices = list(catalog.ids)
+    catalog.close()
+    cache = DistanceCache(args.cache, app.distance_cache_ttl_days * 24 * 3600)
+    failed = precalculate(cache, providers, origins, offices, args.workers)
+    for provider in providers:
+        for origin in origins:
+            print(f'{origin} ({provider.mode}): '
+                  f'{len(cache.get_routes(origin, provider.mode))}/{len(offices)} office distances cached')
+    if failed != 0:
+        print(f'[ERROR] {failed} batches failed, run again to resume')
+    cache.close()
+
 
-with open(f'office_distances.json', 'w+') as f:
-    f.write(json.dumps(distances))
+if __name__ == '__main__':
+    main()
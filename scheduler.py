@@ -0,0 +1,93 @@
+import random
+import sqlite3
+from collections import deque
+from datetime import datetime
+from time import time
+from typing import Deque, List, Optional
+
+# how many attempts' worth of the overall rate a weekday hour starts from, so a few lucky attempts
+# don't make an hour look productive
+prior_attempts = 5.0
+
+
+class AttemptScheduler:
+    # how long to sleep after a failed attempt: densely in the weekday hours (local time) that offered citas
+    # before, sparsely in the dead ones, backing off exponentially on server errors and never beyond
+    # a budget of attempts per hour; attempt outcomes are kept in SQLite, so the model survives restarts
+    attempts: List[List[float]]  # [weekday][hour] -> attempts, weighted by age
+    productive: List[List[float]]  # [weekday][hour] -> attempts that were offered offices or citas
+    recent: Deque[float]  # attempts within the last hour
+
+    def __init__(self, path: str, min_seconds: float, max_seconds: float, attempts_per_hour: int = 0,
+                 half_life_days: float = 28.0, jitter: float = 0.2, backoff_max_seconds: float = 3600):
+        self.min_seconds = min_seconds
+        self.max_seconds = max(min_seconds, max_seconds)
+        self.attempts_per_hour = attempts_per_hour
+        self.half_life_seconds = half_life_days * 24 * 3600
+        self.jitter = jitter
+        self.backoff_max_seconds = backoff_max_seconds
+        self.server_errors = 0  # in a row
+        self.conn = sqlite3.connect(path or ':memory:', timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS attempts ('
+                              'at REAL NOT NULL, saw_slots INTEGER NOT NULL, server_error INTEGER NOT NULL)')
+        self.load()
+
+    def load(self):
+        now = time()
+        self.attempts = [[0.0] * 24 for _ in range(7)]
+        self.productive = [[0.0] * 24 for _ in range(7)]
+        self.recent = deque()
+        # older attempts weigh under 1/256, not worth reading
+        rows = self.conn.execute('SELECT at, saw_slots FROM attempts WHERE at >= ? ORDER BY at',
+                                 (now - 8 * self.half_life_seconds,))
+        for at, saw_slots in rows:
+            self.add(at, bool(saw_slots), 0.5 ** ((now - at) / self.half_life_seconds))
+            if at >= now - 3600:
+                self.recent.append(at)
+
+    def add(self, at: float, saw_slots: bool, weight: float):
+        t = datetime.fromtimestamp(at)
+        self.attempts[t.weekday()][t.hour] += weight
+        if saw_slots:
+            self.productive[t.weekday()][t.hour] += weight
+
+    def record(self, saw_slots: bool, server_error: bool, at: Optional[float] = None):
+        at = time() if at is None else at
+        with self.conn:
+            self.conn.execute('INSERT INTO attempts (at, saw_slots, server_error) VALUES (?, ?, ?)',
+                              (at, int(saw_slots), int(server_error)))
+        self.add(at, saw_slots, 1.0)
+        self.recent.append(at)
+        self.server_errors = self.server_errors + 1 if server_error else 0
+
+    def rate(self, weekday: int, hour: int, overall: float) -> float:
+        # share of attempts that were offered offices or citas in this weekday hour, pulled towards the overall share
+        return (self.productive[weekday][hour] + prior_attempts * overall) / \
+            (self.attempts[weekday][hour] + prior_attempts)
+
+    def productivity(self, at: float) -> float:
+        # relative to the best weekday hour: 1 there, towards 0 in hours that never offered anything
+        overall = (sum(map(sum, self.productive)) + 1) / (sum(map(sum, self.attempts)) + 2)
+        best = max(self.rate(w, h, overall) for w in range(7) for h in range(24))
+        t = datetime.fromtimestamp(at)
+        return self.rate(t.weekday(), t.hour, overall) / best
+
+    def next_delay(self, now: Optional[float] = None) -> float:
+        now = time() if now is None else now
+        delay = self.max_seconds * (self.min_seconds / self.max_seconds) ** self.productivity(now)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        if self.server_errors != 0:
+            backoff = min(self.backoff_max_seconds, self.min_seconds * 2 ** self.server_errors)
+            delay = max(delay, random.uniform(backoff / 2, backoff))
+
+        while len(self.recent) != 0 and self.recent[0] < now - 3600:
+            self.recent.popleft()
+        if self.attempts_per_hour > 0 and len(self.recent) >= self.attempts_per_hour:
+            # wait until the oldest attempt of the last hour drops out of the budget
+            delay = max(delay, self.recent[len(self.recent) - self.attempts_per_hour] + 3600 - now)
+        return delay
+
+    def close(self):
+        self.conn.close()
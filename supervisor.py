@@ -0,0 +1,160 @@
+from time import perf_counter, sleep
+from typing import TYPE_CHECKING, List, Optional
+from constants import *
+from config import App
+from chrome_launcher import is_up
+
+if TYPE_CHECKING:
+    from main import AutoCita  # main runs the supervisor
+
+try:
+    import psutil
+except ImportError:  # psutil is optional, without it the browser's memory isn't watched
+    psutil = None
+
+# mistakes in the config, restarting won't fix them
+config_errors = (ValueError, CountryNotFoundError, OfficeNotFoundError, TramiteNotFoundError, UnsupportedTramiteError)
+
+
+def attached_browser_process(address: str) -> Optional['psutil.Process']:
+    # the main process of the Chrome listening on this debugging address, its helpers don't have the flag
+    flag = f'--remote-debugging-port={address.rsplit(":", 1)[1]}'
+    for p in psutil.process_iter(['cmdline']):
+        cmdline = p.info['cmdline'] or []
+        if flag in cmdline and not any(a.startswith('--type=') for a in cmdline):
+            return p
+    return None
+
+
+class Supervisor:
+    # keeps AutoCita.work() going for days: between attempts the browser is recycled in place when it stops
+    # answering, when its process tree's RSS passes a threshold or after a number of attempts; a crash
+    # (a dead chromedriver, a renderer crash, a stray TimeoutException) is followed by a backoff and a fresh
+    # browser, and the loop goes on with the same scheduler, history and metrics
+    attempts: int  # since the browser was last started
+    crashes: int  # in a row
+
+    def __init__(self, c: 'AutoCita', app: App):
+        self.c = c
+        self.max_rss = app.recycle_browser_rss_mb * 1024 * 1024
+        self.max_attempts = app.recycle_browser_attempts
+        self.backoff_min_seconds = app.restart_backoff_min_seconds
+        self.backoff_max_seconds = max(app.restart_backoff_min_seconds, app.restart_backoff_max_seconds)
+        self.lazy_browser = app.transport == 'hybrid' and app.hybrid_lazy_browser
+        self.attempts = 0
+        self.crashes = 0
+        if psutil is None and self.max_rss > 0:
+            print(f'[WARNING] psutil is not installed, the browser is not recycled at '
+                  f'{app.recycle_browser_rss_mb} MB of RSS, install it or set recycle_browser_rss_mb to 0')
+            self.max_rss = 0
+        if psutil is None and app.chrome_debugger_address:
+            print('[WARNING] psutil is not installed, an attached Chrome is only detached from and reattached to '
+                  'instead of restarted when the browser is recycled')
+        c.before_attempt = self.before_attempt
+
+    def run(self) -> bool:
+        while True:
+            try:
+                return self.c.work()
+            except config_errors:
+                raise
+            except Exception as e:
+                self.crashes += 1
+                delay = min(self.backoff_max_seconds, self.backoff_min_seconds * 2 ** (self.crashes - 1))
+                print(f'[ERROR] {type(e).__name__}: {e}, restarting the browser in {delay:.1f} seconds')
+                self.c.metrics.event('crash')
+                sleep(delay)
+                self.c.metrics.slept(delay)
+                try:
+                    self.recycle('crash')
+                except config_errors:
+                    raise
+                except Exception as e:
+                    # the next attempt fails on the missing browser and this is tried again, backing off further
+                    print(f'[ERROR] Failed to restart the browser: {type(e).__name__}: {e}')
+
+    def before_attempt(self):
+        if self.attempts != 0:
+            self.crashes = 0  # the last attempt ended without one
+        self.attempts += 1
+        if self.c.browser is None:
+            return
+        reason = None
+        rss = self.rss() if self.max_rss > 0 else 0
+        if not self.healthy():
+            reason = 'not answering'
+        elif rss > self.max_rss > 0:
+            reason = f'RSS {rss / 1024 / 1024:.0f} MB'
+        elif self.max_attempts > 0 and self.attempts > self.max_attempts:
+            reason = f'{self.attempts - 1} attempts'
+        if reason is not None:
+            self.recycle(reason)
+            self.attempts = 1
+
+    def healthy(self) -> bool:
+        try:
+            return self.c.browser.execute_script('return 1') == 1
+        except Exception:  # a WebDriverException, or the connection to chromedriver is gone
+            return False
+
+    def processes(self) -> List['psutil.Process']:
+        # the browser's process tree: chromedriver and everything it spawned, or the attached Chrome
+        if psutil is None or self.c.browser is None:
+            return []
+        try:
+            if self.c.chrome_debugger_address:
+                root = attached_browser_process(self.c.chrome_debugger_address)
+                if root is None:
+                    return []
+            else:
+                root = psutil.Process(self.c.browser.service.process.pid)
+            return [root] + root.children(recursive=True)
+        except psutil.Error:
+            return []
+
+    def rss(self) -> int:
+        total = 0
+        for p in self.processes():
+            try:
+                total += p.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    def recycle(self, reason: str):
+        start = perf_counter()
+        restarted = True
+        if self.c.chrome_debugger_address:
+            # quitting only detaches from an attached Chrome, end it and let chrome_launcher.py start a new one
+            root = attached_browser_process(self.c.chrome_debugger_address) if psutil is not None else None
+            if root is not None:
+                root.terminate()
+                psutil.wait_procs([root], timeout=10)
+            else:
+                # not found, or no psutil to find it with: still answering, the same Chrome is attached to again
+                restarted = not is_up(self.c.chrome_debugger_address)
+        else:
+            # quit() waits for chromedriver, hold on to the tree to make sure nothing outlives it
+            processes = self.processes()
+            self.c.quit_browser()
+            if psutil is not None:
+                _, alive = psutil.wait_procs(processes, timeout=5)
+                for p in alive:
+                    try:
+                        p.kill()
+                    except psutil.Error:
+                        pass
+        self.c.quit_browser()
+        self.c.metrics.event('browser_recycled' if restarted else 'browser_reattached')
+        self.attempts = 0
+        if self.c.chrome_debugger_address:
+            deadline = perf_counter() + 60
+            while not is_up(self.c.chrome_debugger_address) and perf_counter() < deadline:
+                sleep(0.5)
+        if not self.lazy_browser:  # otherwise hand_over starts it once a cita is offered
+            self.c.start_browser()
+        if restarted:
+            print(f'[INFO] Browser recycled ({reason}) in {perf_counter() - start:.1f} s')
+        else:
+            print(f'[WARNING] Could not end the attached Chrome, reattached to it ({reason}) '
+                  f'in {perf_counter() - start:.1f} s')
@@ -0,0 +1,13 @@
+import importlib.util
+import os
+import sys
+
+# the modules are flat at the top of the repository
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+
+# config.py is the user's own copy of config.example.py, the defaults do for the tests
+if importlib.util.find_spec('config') is None:
+    spec = importlib.util.spec_from_file_location('config', os.path.join(root_path, 'config.example.py'))
+    sys.modules['config'] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules['config'])
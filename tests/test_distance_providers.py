@@ -0,0 +1,103 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from urllib.parse import parse_qs, urlparse
+import pytest
+from distance_cache import DistanceCache
+from distance_providers import GoogleDistanceProvider
+from precalculate_office_distances import precalculate
+
+
+class StandInServer(ThreadingHTTPServer):
+    # a local Distance Matrix endpoint: answers the scripted failures in order, then every request succeeds
+    def __init__(self, script: List[str]):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.script = list(script)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def api_url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/maps/api/distancematrix/json'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+            failure = self.server.script.pop(0) if self.server.script else None
+        if failure is not None and failure.isdigit():
+            self.reply(int(failure), {})
+            return
+        if failure is not None:
+            self.reply(200, {'status': failure, 'rows': []})
+            return
+        params = parse_qs(urlparse(self.path).query)
+        destinations = params['destinations'][0].split('|')
+        elements = [{'status': 'ZERO_RESULTS'} if name == 'ISLAND' else
+                     {'status': 'OK', 'distance': {'value': 1000 + i}, 'duration': {'value': 60 + i}}
+                     for i, name in enumerate(destinations)]
+        self.reply(200, {'status': 'OK', 'rows': [{'elements': elements}]})
+
+    def reply(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in(request):
+    server = StandInServer(getattr(request, 'param', []))
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def provider(server: StandInServer, retries: int = 3) -> GoogleDistanceProvider:
+    return GoogleDistanceProvider('key', 'driving', batch_size=2, api_url=server.api_url, retries=retries,
+                                  backoff_seconds=0.01, timeout_seconds=5)
+
+
+@pytest.mark.parametrize('stand_in', [['503', 'OVER_QUERY_LIMIT', '429', 'UNKNOWN_ERROR']], indirect=True)
+def test_transient_errors_are_retried(stand_in):
+    routes = provider(stand_in, retries=4).get_routes_batch('Origin', ['A', 'ISLAND'])
+    assert routes == {'A': (1000, 60), 'ISLAND': None}
+    assert stand_in.requests == 5
+
+
+@pytest.mark.parametrize('stand_in', [['500', '502', 'OVER_QUERY_LIMIT']], indirect=True)
+def test_gives_up_after_the_retries(stand_in):
+    with pytest.raises(Exception, match='OVER_QUERY_LIMIT'):
+        provider(stand_in, retries=2).get_routes_batch('Origin', ['A'])
+    assert stand_in.requests == 3
+
+
+@pytest.mark.parametrize('stand_in', [['REQUEST_DENIED']], indirect=True)
+def test_permanent_errors_are_not_retried(stand_in):
+    with pytest.raises(Exception, match='REQUEST_DENIED'):
+        provider(stand_in).get_routes_batch('Origin', ['A'])
+    assert stand_in.requests == 1
+
+
+@pytest.mark.parametrize('stand_in', [['503', 'OVER_QUERY_LIMIT']], indirect=True)
+def test_precalculate_against_the_stand_in(stand_in):
+    offices = ['A', 'B', 'C', 'ISLAND', 'E']
+    cache = DistanceCache(':memory:', 3600)
+    assert precalculate(cache, [provider(stand_in)], ['Origin'], offices, 2) == 0
+    routes = cache.get_routes('Origin', 'driving')
+    assert sorted(routes) == sorted(offices)
+    assert routes['ISLAND'] is None
+    requests = stand_in.requests
+    # the cache is the checkpoint, a second run asks for nothing
+    assert precalculate(cache, [provider(stand_in)], ['Origin'], offices, 2) == 0
+    assert stand_in.requests == requests
+    cache.close()
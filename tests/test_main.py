@@ -0,0 +1,44 @@
+import os
+import threading
+import pytest
+from config import App, Info
+from constants import OfficeNotFoundError
+from main import AutoCita
+
+
+def resolver_threads() -> int:
+    return sum(1 for t in threading.enumerate() if t.name == 'distance-resolver')
+
+
+@pytest.fixture
+def app(tmp_path):
+    return App(debug=False, sleep_minutes=0, distance_provider='haversine', history_path='', transport='hybrid',
+               distance_cache_path=os.path.join(tmp_path, 'office_distances.db'),
+               office_catalog_path=os.path.join(tmp_path, 'offices.db'))
+
+
+@pytest.mark.parametrize('info, app_changes, e', [
+    (Info(desired_office_code=1), {}, OfficeNotFoundError),
+    (Info(preferred_office_code=1), {}, OfficeNotFoundError),
+    (Info(), {'http_engine': 'curl'}, ValueError),
+    (Info(max_cita_date='2099-12-31'), {}, ValueError),
+])
+def test_bad_config_leaves_nothing_running(app, info, app_changes, e):
+    for name, value in app_changes.items():
+        setattr(app, name, value)
+    before = resolver_threads()
+    with pytest.raises(e):
+        AutoCita(app, info)
+    assert resolver_threads() == before
+
+
+def test_failed_browser_start_closes_everything(app):
+    app.hybrid_lazy_browser = False
+    before = resolver_threads()
+    try:
+        c = AutoCita(app, Info())
+    except Exception:  # e.g. no Chrome here
+        assert resolver_threads() == before
+    else:
+        c.quit_browser()
+        c.close()
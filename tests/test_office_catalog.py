@@ -0,0 +1,27 @@
+import os
+from office_catalog import OfficeCatalog
+from page import Office
+
+seed = {'CNP MADRID, CALLE DE LA MAGDALENA, 1': 16}
+new_office = Office('99', 'CNP NUEVA OFICINA, CALLE FALSA, 123')
+
+
+def test_learned_offices_are_written_after_the_attempt(tmp_path):
+    path = os.path.join(tmp_path, 'offices.db')
+    catalog = OfficeCatalog(path, seed)
+    assert catalog.learn([Office('16', 'CNP MADRID, CALLE DE LA MAGDALENA, 1'), new_office]) == [new_office]
+    assert '99' in catalog and catalog.ids[new_office.name] == '99'
+    assert catalog.conn.execute('SELECT COUNT(*) FROM offices').fetchone() == (0,)  # nothing written on the hot path
+    catalog.flush()
+    assert catalog.conn.execute('SELECT id, name FROM offices').fetchall() == [(99, new_office.name)]
+    catalog.close()
+
+
+def test_close_writes_what_is_left(tmp_path):
+    path = os.path.join(tmp_path, 'offices.db')
+    catalog = OfficeCatalog(path, seed)
+    catalog.learn([new_office])
+    catalog.close()
+    catalog = OfficeCatalog(path, seed)
+    assert catalog.names['99'] == new_office.name and '99' in catalog.learned
+    catalog.close()
@@ -0,0 +1,54 @@
+from time import sleep
+from distance_providers import HaversineDistanceProvider
+from distance_resolver import DistanceResolver
+from office_ranker import OfficeRanker
+from page import Office
+
+office_coordinates = {'NEAR': (41.39, 2.17), 'FAR': (41.60, 2.30)}
+
+
+def resolve(resolver: DistanceResolver) -> dict:
+    # waits for the worker, collect() itself never blocks
+    routes = {}
+    for _ in range(200):
+        routes |= resolver.collect()
+        if len(resolver.pending) == 0:
+            break
+        sleep(0.01)
+    return routes
+
+
+def test_office_without_coordinates_stays_ranked_last():
+    provider = HaversineDistanceProvider((41.38, 2.17), office_coordinates)
+    ranker = OfficeRanker({'NEAR': 1, 'FAR': 2}, provider.get_routes('', list(office_coordinates)))
+    resolver = DistanceResolver('', provider, None)
+    new = Office('99', 'NEW')
+    offered = [new, Office('2', 'FAR')]
+
+    ranker.learn(offered)
+    resolver.submit(['NEW'])
+    assert ranker.best(o.id for o in offered) == '2'
+    assert ranker.best(['99']) == '99'
+
+    ranker.update(resolve(resolver))
+    assert 'NEW' not in resolver.pending
+    assert ranker.best(o.id for o in offered) == '2'
+    assert ranker.best(['99']) == '99'  # offered alone, it's still chosen
+    resolver.submit(['NEW'])
+    assert 'NEW' not in resolver.pending  # nothing to ask the provider again
+    resolver.close()
+
+
+def test_no_route_is_left_out():
+    ranker = OfficeRanker({'NEAR': 1, 'ISLAND': 2}, {'NEAR': (1000, 60), 'ISLAND': None})
+    assert ranker.best(['2']) is None
+    assert ranker.best(['2', '1']) == '1'
+
+
+def test_estimates_rank_against_routes_until_replaced():
+    ranker = OfficeRanker({'A': 1, 'B': 2, 'C': 3}, {'A': (5000, None)})
+    ranker.estimate({'B': (3000, None), 'C': None})
+    assert ranker.best(['1', '2', '3']) == '2'  # 3900 estimated against 5000
+    ranker.update({'B': (8000, None)})
+    assert ranker.best(['1', '2', '3']) == '1'
+    assert ranker.best(['3']) == '3'
@@ -0,0 +1,62 @@
+import os
+from typing import Tuple
+from constants import no_cita_message
+from page import Page, PageKind, PageScanner, parse_page, extract_hidden_params
+
+uuid_a, uuid_b = '0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0', '1a2b3c4d-5e6f-7a8b-9c0d-1e2f3a4b5c6d'
+
+fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture(name: str) -> str:
+    with open(os.path.join(fixtures_path, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def test_citar_is_not_no_cita():
+    # its notice about the lack of citas in one sede isn't the no cita message
+    assert parse_page(fixture('citar.html')).kind == PageKind.OTHER
+
+
+def test_no_cita():
+    assert parse_page(fixture('acCitar.no_cita.html')).kind == PageKind.NO_CITA
+
+
+def test_scanner_reads_citar_to_the_end():
+    html = fixture('citar.html')
+    scanner = PageScanner(PageKind.OTHER)
+    for i in range(0, len(html), 1024):
+        scanner.feed(html[i:i + 1024])
+    assert scanner.page().kind == PageKind.OTHER
+
+
+def test_hidden_params_in_upper_case():
+    html = (f'<FORM><INPUT TYPE=HIDDEN NAME={uuid_a} VALUE={uuid_b}>'
+            f'<Input Name="{uuid_b}" Type="Hidden" Value="{uuid_a}"/></FORM>')
+    assert extract_hidden_params(html) == {uuid_a: uuid_b, uuid_b: uuid_a}
+
+
+def scan(html: str, expected: PageKind, chunk_size: int = 64) -> Tuple[Page, int]:
+    # (the page, how much of it was read)
+    scanner = PageScanner(expected)
+    for i in range(0, len(html), chunk_size):
+        if scanner.feed(html[i:i + chunk_size]):
+            return scanner.page(), i + chunk_size
+    return scanner.page(), len(html)
+
+
+def test_scanner_sees_no_cita_after_the_params():
+    html = (f'<form><input type="hidden" name="{uuid_a}" value="{uuid_b}"/>'
+            f'<input type="hidden" name="{uuid_b}" value="{uuid_a}"/>' + ' ' * 500 +
+            f'<span>{no_cita_message}</span></form>' + ' ' * 5000)
+    page, read = scan(html, PageKind.OTHER)
+    assert page.kind == PageKind.NO_CITA
+    assert read < len(html)
+
+
+def test_scanner_stops_at_the_end_of_the_form():
+    html = (f'<form><input type="hidden" name="{uuid_a}" value="{uuid_b}"/>'
+            f'<input type="hidden" name="{uuid_b}" value="{uuid_a}"/></form>' + ' ' * 5000)
+    page, read = scan(html, PageKind.OTHER)
+    assert page.kind == PageKind.OTHER
+    assert read < 500
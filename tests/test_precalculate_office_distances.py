@@ -0,0 +1,28 @@
+from typing import Dict, List, Optional
+from distance_cache import DistanceCache, Route
+from precalculate_office_distances import precalculate
+
+
+class StandInProvider:
+    # answers every batch at once, with a distance that tells the origin, mode and office apart
+    def __init__(self, mode: str, batch_size: int = 25):
+        self.mode = mode
+        self.batch_size = batch_size
+
+    def get_routes_batch(self, address: str, office_names: List[str]) -> Dict[str, Optional[Route]]:
+        return {name: (len(address) * 1000 + len(self.mode) * 100 + int(name.split()[-1]), None)
+                for name in office_names}
+
+
+def test_every_origin_and_mode_gets_every_office():
+    offices = [f'OFFICE {i}' for i in range(30)]
+    origins = ['A', 'BB']
+    providers = [StandInProvider('driving'), StandInProvider('walking')]
+    cache = DistanceCache(':memory:', 3600)
+    assert precalculate(cache, providers, origins, offices, 4) == 0
+    for provider in providers:
+        for origin in origins:
+            routes = cache.get_routes(origin, provider.mode)
+            assert sorted(routes) == sorted(offices)
+            assert routes['OFFICE 7'] == (len(origin) * 1000 + len(provider.mode) * 100 + 7, None)
+    cache.close()
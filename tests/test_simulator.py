@@ -0,0 +1,65 @@
+import importlib.util
+import os
+import re
+import socket
+import sys
+import tempfile
+import pytest
+from selenium.common.exceptions import WebDriverException
+from config import App, Info
+import benchmark
+
+spec = importlib.util.spec_from_file_location('simulator', benchmark.simulator_path)
+simulator = sys.modules['simulator'] = importlib.util.module_from_spec(spec)  # Flask finds static/ through it
+spec.loader.exec_module(simulator)
+
+
+@pytest.fixture
+def offline_client():
+    simulator.use_scenario(simulator.scenarios['offline'])
+    yield simulator.app.test_client()
+    simulator.use_scenario(simulator.scenarios['default'])
+
+
+def test_offline_pages_get_their_scripts(offline_client):
+    # acOfertarCita's envia() needs jQuery to open the confirm dialog that select_cita waits for
+    with open(os.path.join(simulator.app.static_folder, 'acOfertarCita.html'), 'r', encoding='utf-8') as f:
+        sources = re.findall(r'<script src="([^"]+)"', simulator.offline_html(f.read()))
+    scripts = {os.path.basename(src): offline_client.get(src).get_data(as_text=True)
+               for src in sources if src.startswith('/')}
+    assert 'window.jQuery = window.$' in scripts['jquery-3.5.1.min.js']
+    assert scripts['icp-6.41.6.min.js'] != ''  # from analysis/js
+    assert scripts['cookielawinfo.js'] == ''  # never saved
+
+
+def test_offline_scripts_without_jsessionid(offline_client):
+    response = offline_client.get('/icpplustieb/resources/js/jquery-3.5.1.min.js;jsessionid=217BEC0DA42F06349C0C6C82')
+    assert 'window.jQuery' in response.get_data(as_text=True)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_selenium_flow_gets_past_acOfertarCita():
+    # the whole browser flow against the offline simulator, up to the SMS verification; needs Chrome
+    temp_path = tempfile.mkdtemp()
+    app = App(debug=False, sleep_minutes=0, distance_provider='haversine', history_path='',
+              distance_cache_path=os.path.join(temp_path, 'office_distances.db'),
+              office_catalog_path=os.path.join(temp_path, 'offices.db'))
+    port = free_port()
+    proc = benchmark.start_simulator(port)
+    try:
+        try:
+            steps, _, start_run = benchmark.selenium_flow(f'http://127.0.0.1:{port}', app,
+                                                          Info(max_cita_date='31/12/2099'))
+        except WebDriverException as e:
+            pytest.skip(f'no Chrome to run the flow with: {e.msg}')
+        start_run()
+        for name, step in steps:
+            step()
+    finally:
+        proc.terminate()
+        proc.wait()
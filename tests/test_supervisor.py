@@ -0,0 +1,56 @@
+import pytest
+from config import App
+from metrics import Metrics
+import supervisor
+from supervisor import Supervisor
+
+
+class StandInAutoCita:
+    # what the supervisor uses of AutoCita, counting the browser starts and quits
+    def __init__(self, chrome_debugger_address: str = ''):
+        self.chrome_debugger_address = chrome_debugger_address
+        self.browser = object()
+        self.metrics = Metrics()
+        self.starts = 0
+        self.quits = 0
+
+    def start_browser(self):
+        self.starts += 1
+
+    def quit_browser(self):
+        self.quits += 1
+
+
+@pytest.fixture
+def no_psutil(monkeypatch):
+    monkeypatch.setattr(supervisor, 'psutil', None)
+
+
+def test_rss_limit_without_psutil_is_warned_about(no_psutil, capsys):
+    s = Supervisor(StandInAutoCita(), App(recycle_browser_rss_mb=1500))
+    assert 'psutil is not installed' in capsys.readouterr().out
+    assert s.max_rss == 0
+
+
+def test_no_warning_without_rss_limit(no_psutil, capsys):
+    Supervisor(StandInAutoCita(), App(recycle_browser_rss_mb=0))
+    assert capsys.readouterr().out == ''
+
+
+def test_reattaching_to_attached_chrome_is_no_recycle(no_psutil, monkeypatch):
+    monkeypatch.setattr(supervisor, 'is_up', lambda address: True)
+    c = StandInAutoCita('127.0.0.1:9222')
+    s = Supervisor(c, App(recycle_browser_rss_mb=0, chrome_debugger_address=c.chrome_debugger_address))
+    s.recycle('2 attempts')
+    assert c.metrics.events == {'browser_reattached': 1}
+    assert (c.quits, c.starts) == (1, 1)
+
+
+def test_ended_attached_chrome_is_recycled(no_psutil, monkeypatch):
+    # gone, and back up once chrome_launcher.py starts it again
+    answers = iter([False, True])
+    monkeypatch.setattr(supervisor, 'is_up', lambda address: next(answers))
+    c = StandInAutoCita('127.0.0.1:9222')
+    s = Supervisor(c, App(recycle_browser_rss_mb=0, chrome_debugger_address=c.chrome_debugger_address))
+    s.recycle('crash')
+    assert c.metrics.events == {'browser_recycled': 1}
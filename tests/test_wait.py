@@ -0,0 +1,35 @@
+import pytest
+from selenium.common.exceptions import InvalidSessionIdException, JavascriptException, WebDriverException
+from wait import Waiter
+
+
+class StandInBrowser:
+    # answers execute_async_script with the scripted results in order, raising the exceptions among them
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def set_script_timeout(self, timeout: float):
+        pass
+
+    def execute_async_script(self, script: str, *args):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def test_navigation_is_waited_out():
+    browser = StandInBrowser(JavascriptException('document unloaded while waiting for result'), 'element')
+    assert Waiter(browser, timeout=1, poll_interval=0).element('btnEnviar') == 'element'
+    assert browser.calls == 2
+
+
+@pytest.mark.parametrize('e', [InvalidSessionIdException('invalid session id'),
+                               WebDriverException('chrome not reachable')])
+def test_dead_browser_is_raised_at_once(e):
+    browser = StandInBrowser(e, 'element')
+    with pytest.raises(type(e)):
+        Waiter(browser, timeout=30, poll_interval=0).element('btnEnviar')
+    assert browser.calls == 1
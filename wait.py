@@ -0,0 +1,81 @@
+from time import monotonic, sleep
+from typing import Callable, Optional
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, JavascriptException, NoSuchElementException, \
+    StaleElementReferenceException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+# resolves as soon as the element exists (and, if asked, is visible and enabled), watching the DOM
+# with a MutationObserver instead of polling; resolves null on timeout
+wait_for_element_script = r"""
+var id = arguments[0], clickable = arguments[1], timeout = arguments[2], done = arguments[arguments.length - 1];
+function ready() {
+    var el = document.getElementById(id);
+    if (!el) return null;
+    if (clickable && (el.disabled || el.getClientRects().length === 0)) return null;
+    return el;
+}
+var el = ready();
+if (el) return done(el);
+var observer = new MutationObserver(function () {
+    var el = ready();
+    if (el) {
+        observer.disconnect();
+        clearTimeout(timer);
+        done(el);
+    }
+});
+var timer = setTimeout(function () {
+    observer.disconnect();
+    done(null);
+}, timeout);
+observer.observe(document, {childList: true, subtree: true, attributes: true});
+"""
+# what a navigation in the middle of a wait looks like ("document unloaded while waiting for result");
+# anything else, e.g. an invalid session or an unreachable browser, is raised at once for the supervisor
+navigation_exceptions = (JavascriptException, StaleElementReferenceException, NoSuchElementException)
+
+
+class Waiter:
+    # page readiness waits for AutoCita: element waits resolve on DOM mutations, everything else is
+    # polled at poll_interval instead of WebDriverWait's default 0.5 s
+
+    def __init__(self, browser: webdriver.Chrome, timeout: float = 30, poll_interval: float = 0.05,
+                 use_observer: bool = True):
+        self.browser = browser
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.use_observer = use_observer
+        if use_observer:
+            self.browser.set_script_timeout(timeout + 5)
+
+    def until(self, condition: Callable, timeout: Optional[float] = None):
+        return WebDriverWait(self.browser, self.timeout if timeout is None else timeout,
+                             poll_frequency=self.poll_interval).until(condition)
+
+    def element(self, id: str, clickable: bool = False) -> WebElement:
+        if not self.use_observer:
+            condition = EC.element_to_be_clickable if clickable else EC.presence_of_element_located
+            return self.until(condition((By.ID, id)))
+
+        deadline = monotonic() + self.timeout
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise TimeoutException(f'Element {id} not ready after {self.timeout}s')
+            try:
+                el = self.browser.execute_async_script(wait_for_element_script, id, clickable,
+                                                       int(remaining * 1000))
+            except navigation_exceptions:
+                # the document was replaced while observing (e.g. the form submission navigated), observe the new one
+                sleep(self.poll_interval)
+                continue
+            if el is None:
+                raise TimeoutException(f'Element {id} not ready after {self.timeout}s')
+            return el
+
+    def clickable(self, id: str) -> WebElement:
+        return self.element(id, clickable=True)